@@ -0,0 +1,252 @@
+import asyncio
+import math
+import os
+import re
+import time
+from collections import deque
+from typing import Dict, Optional
+import anyio.to_thread
+from starlette.responses import JSONResponse
+
+# Admission Control Config
+MONGO_CONCURRENCY = int(os.getenv("MONGO_CONCURRENCY", "64"))
+DIFY_CONCURRENCY = int(os.getenv("DIFY_CONCURRENCY", "8"))
+# Sync handlers run in the anyio threadpool; it is sized to the Mongo limit plus headroom for
+# exempt routes (see size_threadpool), so admitted requests never queue again in the pool
+THREADPOOL_HEADROOM = int(os.getenv("THREADPOOL_HEADROOM", "8"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "128"))  # Per lane
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+BULK_LANE_SHARE = float(os.getenv("BULK_LANE_SHARE", "0.5"))  # Max fraction of slots bulk work may hold
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "20"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "40"))
+MAX_TRACKED_CLIENTS = 10000
+PRUNE_FRACTION = 0.1  # Share of buckets evicted at once when the table is full of active clients
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("Dependency overloaded")
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """Bounded concurrency for one downstream dependency, with two priority lanes.
+
+    Interactive requests may use every slot and are woken first; bulk requests
+    (list endpoints, exports, bulk writes) are capped at `bulk_share` of the
+    slots so they can never starve cheap reads. Each lane has a bounded queue and
+    waiters that can't get a slot within `queue_timeout` are shed.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int = ADMISSION_QUEUE_SIZE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT, bulk_share: float = BULK_LANE_SHARE):
+        self.name = name
+        self.limit = limit
+        self.bulk_limit = max(1, int(limit * bulk_share))
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_use = {INTERACTIVE: 0, BULK: 0}
+        self.waiters = {INTERACTIVE: deque(), BULK: deque()}
+        self.admitted = 0
+        self.shed = 0
+        self.avg_service_time = 0.1
+
+    def _has_slot(self, lane: str) -> bool:
+        if self.in_use[INTERACTIVE] + self.in_use[BULK] >= self.limit:
+            return False
+        return lane == INTERACTIVE or self.in_use[BULK] < self.bulk_limit
+
+    def retry_after(self) -> int:
+        queued = len(self.waiters[INTERACTIVE]) + len(self.waiters[BULK])
+        return max(1, math.ceil(self.avg_service_time * (queued + 1) / self.limit))
+
+    async def acquire(self, lane: str):
+        if not self.waiters[lane] and self._has_slot(lane):
+            self.in_use[lane] += 1
+            self.admitted += 1
+            return
+
+        if len(self.waiters[lane]) >= self.max_queue:
+            self.shed += 1
+            raise Overloaded(self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[lane].append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just as we gave up; hand it back
+                self.release(lane)
+            else:
+                waiter.cancel()
+                self.waiters[lane].remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.shed += 1
+            raise Overloaded(self.retry_after())
+        self.admitted += 1
+
+    def release(self, lane: str, service_time: Optional[float] = None):
+        self.in_use[lane] -= 1
+        if service_time is not None:
+            self.avg_service_time = 0.9 * self.avg_service_time + 0.1 * service_time
+        self._wake()
+
+    def _wake(self):
+        # Slots are handed over directly so a newcomer can't jump the queue
+        for lane in (INTERACTIVE, BULK):
+            queue = self.waiters[lane]
+            while queue and self._has_slot(lane):
+                waiter = queue.popleft()
+                if waiter.done():
+                    continue
+                self.in_use[lane] += 1
+                waiter.set_result(None)
+
+    def metrics(self) -> dict:
+        return {
+            "limit": self.limit,
+            "bulk_limit": self.bulk_limit,
+            "in_use": dict(self.in_use),
+            "queue_depth": {lane: len(queue) for lane, queue in self.waiters.items()},
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "avg_service_time": round(self.avg_service_time, 4)
+        }
+
+
+class TokenBucketLimiter:
+    """Per-client token buckets; `take` returns seconds to wait, or 0 if admitted."""
+
+    def __init__(self, rate: float = RATE_LIMIT_PER_SECOND, burst: float = RATE_LIMIT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.buckets: Dict[str, list] = {}
+        self.rejected = 0
+
+    def take(self, client_id: str, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        bucket = self.buckets.get(client_id)
+        if bucket is None:
+            if len(self.buckets) >= MAX_TRACKED_CLIENTS:
+                self._prune(now)
+            bucket = self.buckets[client_id] = [self.burst, now]
+
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0.0
+
+        self.rejected += 1
+        return (cost - bucket[0]) / self.rate
+
+    def _prune(self, now: float):
+        # Buckets that have refilled completely carry no state worth keeping
+        full = [client for client, (tokens, last) in self.buckets.items()
+                if tokens + (now - last) * self.rate >= self.burst]
+        for client in full:
+            del self.buckets[client]
+
+        # Still full: evict the least recently seen clients too, so the table stays bounded
+        excess = len(self.buckets) - MAX_TRACKED_CLIENTS + max(1, int(MAX_TRACKED_CLIENTS * PRUNE_FRACTION))
+        if excess > 0:
+            oldest = sorted(self.buckets, key=lambda client: self.buckets[client][1])[:excess]
+            for client in oldest:
+                del self.buckets[client]
+
+    def metrics(self) -> dict:
+        return {"clients": len(self.buckets), "rejected": self.rejected}
+
+
+# (method, path regex, dependency, lane, token cost). First match wins; None dependency means exempt.
+ROUTE_RULES = [
+    ("OPTIONS", r".*", None, None, 0),
+    ("GET", r"^/api/metrics/", None, None, 0),
+    ("GET", r"^/api/live$", None, None, 0),  # Long-lived stream, bounded by LIVE_MAX_SUBSCRIBERS
+    ("POST", r"^/api/chat$", "dify", INTERACTIVE, 5),
+    ("PUT", r"^/api/inventory/bulk$", "mongo", BULK, 5),
+    ("GET", r"^/api/(inventory|orders|automations)$", "mongo", BULK, 1),
+    ("GET", r"^/api/logs/[^/]+$", "mongo", BULK, 1),
+    ("GET", r"^/api/reports/[^/]+/artifact$", "mongo", BULK, 1),
+    ("*", r"^/api/", "mongo", INTERACTIVE, 1),
+]
+ROUTE_RULES = [(method, re.compile(pattern), dependency, lane, cost)
+               for method, pattern, dependency, lane, cost in ROUTE_RULES]
+
+limiters = {
+    "mongo": ConcurrencyLimiter("mongo", MONGO_CONCURRENCY),
+    "dify": ConcurrencyLimiter("dify", DIFY_CONCURRENCY),
+}
+rate_limiter = TokenBucketLimiter()
+threadpool_size = None  # Set by size_threadpool() at startup
+
+
+def size_threadpool():
+    """Match Starlette's threadpool (40 threads by default) to the Mongo limiter.
+
+    Must run on the event loop, i.e. from an async startup handler.
+    """
+    global threadpool_size
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = max(limiter.total_tokens, MONGO_CONCURRENCY + THREADPOOL_HEADROOM)
+    threadpool_size = limiter.total_tokens
+
+
+def classify(method: str, path: str):
+    for rule_method, pattern, dependency, lane, cost in ROUTE_RULES:
+        if rule_method in (method, "*") and pattern.match(path):
+            return dependency, lane, cost
+    return None, None, 0
+
+
+def admission_metrics() -> dict:
+    return {
+        "limiters": {name: limiter.metrics() for name, limiter in limiters.items()},
+        "rate_limit": rate_limiter.metrics(),
+        "threadpool_size": threadpool_size
+    }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the per-client rate limit and per-dependency limiters."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        dependency, lane, cost = classify(scope["method"], scope["path"])
+        if dependency is None:
+            return await self.app(scope, receive, send)
+
+        client = scope.get("client")
+        wait = rate_limiter.take(client[0] if client else "unknown", cost)
+        if wait:
+            response = JSONResponse(
+                {"detail": "Too many requests"}, status_code=429,
+                headers={"Retry-After": str(math.ceil(wait))}
+            )
+            return await response(scope, receive, send)
+
+        limiter = limiters[dependency]
+        try:
+            await limiter.acquire(lane)
+        except Overloaded as e:
+            response = JSONResponse(
+                {"detail": f"Service overloaded ({dependency})"}, status_code=503,
+                headers={"Retry-After": str(e.retry_after)}
+            )
+            return await response(scope, receive, send)
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(lane, time.monotonic() - started)
@@ -2,14 +2,27 @@ import os
 import re
 from bson import ObjectId
 # FIX: Imported 'automation_collection' (singular) matching your database.py
-from database import inventory_collection, logs_collection, orders_collection, automation_collection
+from database import inventory_collection, logs_collection, orders_collection, automation_collection, reports_collection
 from datetime import datetime, timedelta
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from typing import List, Optional, Any
 from urllib import response
+import asyncio
 import httpx
+from copilot_cache import answer_cache, context_snapshot, copilot_metrics, is_opening_question, query_with_history
+from data_version import bump_data_version, current_data_version
+from singleflight import aggregate_flight
+from admission import AdmissionMiddleware, admission_metrics, size_threadpool
+from log_archive import ensure_log_indexes, find_logs, movement_total
+from order_counters import change_order_status, create_order, ensure_order_counters, order_kpis, remove_order
+from delta_sync import changes_since, ensure_sync_indexes, record_tombstone, stamp, stamped_bulk_write
+from live_updates import TOPICS as LIVE_TOPICS, live_broker, watch_movements
+from sse_starlette.sse import EventSourceResponse
+from fastapi.responses import FileResponse
+from reports import REPORT_FORMATS, REPORT_TYPES, ReportQueueFull, report_queue
+from inventory_mirror import MIRROR_ENABLED, inventory_mirror
 
 # Gemini Config
 DIFY_API_KEY = "enter dify key" 
@@ -17,6 +30,9 @@ DIFY_API_URL = "https://api.dify.ai/v1/chat-messages"
 
 app = FastAPI()
 
+# Admission control (registered before CORS so rejections still carry CORS headers)
+app.add_middleware(AdmissionMiddleware)
+
 # Cors config
 app.add_middleware(
     CORSMiddleware,
@@ -26,6 +42,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def configure_threadpool():
+    size_threadpool()
+
+@app.on_event("startup")
+def create_indexes():
+    ensure_sync_indexes()
+    ensure_log_indexes()
+    ensure_order_counters()
+
+@app.on_event("startup")
+async def start_live_updates():
+    live_broker.start(kpi_source=lambda: aggregate_flight.do("dashboard", compute_dashboard_data))
+    watch_movements(logs_collection, on_insert=bump_data_version)
+
+@app.on_event("startup")
+def start_report_queue():
+    report_queue.recover()
+
+@app.on_event("startup")
+def start_inventory_mirror():
+    if MIRROR_ENABLED:
+        inventory_mirror.start()
+
+@app.on_event("shutdown")
+def stop_report_queue():
+    report_queue.shutdown()
+
 # Data Models
 class Message(BaseModel):
     role: str
@@ -44,14 +88,30 @@ async def chat_endpoint(request: ChatRequest):
 
         last_user_message = request.messages[-1].content
 
+        # Follow-ups depend on earlier turns, so only an opening question uses the cache.
+        # A cached answer has no Dify conversation (conversation_id is None); the next
+        # turn then replays the history from `messages` instead.
+        data_version = await asyncio.to_thread(current_data_version)
+        use_cache = not request.conversation_id and is_opening_question(request.messages)
+        if use_cache:
+            cached_answer = answer_cache.get(last_user_message, data_version)
+            if cached_answer is not None:
+                return {
+                    "role": "model",
+                    "content": cached_answer,
+                    "conversation_id": None
+                }
+
+        inventory_context = await asyncio.to_thread(context_snapshot.get, data_version)
+
         headers = {
             "Authorization": f"Bearer {DIFY_API_KEY}",
             "Content-Type": "application/json"
         }
 
         payload = {
-            "inputs": {},
-            "query": last_user_message,
+            "inputs": {"inventory_context": inventory_context},
+            "query": last_user_message if request.conversation_id else query_with_history(request.messages),
             "response_mode": "blocking",
             "user": "api-user-1234", 
             "files": []
@@ -71,6 +131,9 @@ async def chat_endpoint(request: ChatRequest):
             bot_response = dify_data.get("answer", "")
             new_conversation_id = dify_data.get("conversation_id", "")
 
+            if use_cache and bot_response:
+                answer_cache.put(last_user_message, data_version, bot_response)
+
             return {
                 "role": "model",
                 "content": bot_response,
@@ -81,6 +144,39 @@ async def chat_endpoint(request: ChatRequest):
         print(f"Error: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+@app.get("/api/metrics/copilot")
+def get_copilot_metrics():
+    return copilot_metrics()
+
+@app.get("/api/metrics/singleflight")
+def get_singleflight_metrics():
+    return aggregate_flight.metrics()
+
+@app.get("/api/metrics/admission")
+def get_admission_metrics():
+    return admission_metrics()
+
+# async: the subscriber set is only safe to read from the event loop
+@app.get("/api/metrics/live")
+async def get_live_metrics():
+    return live_broker.metrics()
+
+@app.get("/api/metrics/mirror")
+def get_mirror_metrics():
+    return inventory_mirror.metrics()
+
+# Server push: SSE stream of coalesced change frames, e.g. /api/live?topics=inventory,kpis
+@app.get("/api/live")
+async def live_updates(topics: str = "inventory,movements,orders,kpis"):
+    requested = {topic.strip() for topic in topics.split(",") if topic.strip()}
+    unknown = requested - LIVE_TOPICS
+    if not requested or unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown live topics: {', '.join(sorted(unknown)) or topics!r}")
+    subscriber = live_broker.subscribe(requested)
+    if subscriber is None:
+        raise HTTPException(status_code=503, detail="Too many live subscribers")
+    return EventSourceResponse(live_broker.frames(subscriber))
+
 # Helpers
 def inventory_helper(inventory) -> dict:
     stock = inventory.get("stock", 0)
@@ -95,7 +191,9 @@ def inventory_helper(inventory) -> dict:
         "minStock": inventory.get("minStock"),
         "location": inventory.get("location"),
         "unitPrice": unit_price,
-        "totalValue": f"${calculated_total:,.2f}"
+        "totalValue": f"${calculated_total:,.2f}",
+        "safetyStock": inventory.get("safetyStock"),
+        "reorderPoint": inventory.get("reorderPoint")
     }
 
 # Reading data model
@@ -108,6 +206,8 @@ class InventoryItem(BaseModel):
     location: str
     unitPrice: float
     totalValue: str
+    safetyStock: Optional[int] = None  # Maintained by replenishment.py
+    reorderPoint: Optional[int] = None
 
 # Writing data model
 class NewInventoryItem(BaseModel):
@@ -119,17 +219,48 @@ class NewInventoryItem(BaseModel):
     unitPrice: float
 
 @app.get("/api/inventory", response_model=List[InventoryItem])
-def get_inventory():
+def get_inventory(category: Optional[str] = None, location: Optional[str] = None, low_stock: bool = False):
+    # Served from the in-process mirror when it's running (INVENTORY_MIRROR=1)
+    if inventory_mirror.ready:
+        return inventory_mirror.items(category, location, low_stock)
+
+    query = {}
+    if category is not None:
+        query["category"] = category
+    if location is not None:
+        query["location"] = location
+    if low_stock:
+        query["$expr"] = {"$lt": ["$stock", "$minStock"]}
     inventories = []
-    for inventory in inventory_collection.find():
+    for inventory in inventory_collection.find(query):
         inventories.append(inventory_helper(inventory))
     return inventories
 
+# Delta sync: only documents changed (and ids deleted) since the client's cursor
+@app.get("/api/inventory/changes")
+def get_inventory_changes(since: Optional[str] = None):
+    return changes_since("inventory", inventory_collection.find, inventory_helper, since)
+
+@app.get("/api/inventory/{sku}", response_model=InventoryItem)
+def get_inventory_item(sku: str):
+    if inventory_mirror.ready:
+        item = inventory_mirror.get(sku)
+    else:
+        if not ObjectId.is_valid(sku):
+            raise HTTPException(status_code=404, detail="Item not found")
+        inventory = inventory_collection.find_one({"_id": ObjectId(sku)})
+        item = inventory_helper(inventory) if inventory else None
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return item
+
 @app.post("/api/inventory", response_model=InventoryItem)
 def add_inventory_item(item: NewInventoryItem):
-    inventory_data = item.dict()
+    inventory_data = {**item.dict(), **stamp("inventory")}
     new_inventory = inventory_collection.insert_one(inventory_data)
+    bump_data_version()
     created_inventory = inventory_collection.find_one({"_id": new_inventory.inserted_id})
+    live_broker.publish("inventory", str(new_inventory.inserted_id), inventory_helper(created_inventory), replace=True)
     return inventory_helper(created_inventory)
 
 
@@ -155,13 +286,12 @@ def bulk_update_inventory(data: BulkUpdateItem):
         
         if not updates:
              return {"message": "No updates provided"}
-
-        result = inventory_collection.update_many(
-            {"_id": {"$in": object_ids}},
-            {"$set": updates}
-        )
+        modified = stamped_bulk_write("inventory", [(object_id, updates) for object_id in object_ids])
+        bump_data_version()
+        for sku in data.skus:
+            live_broker.publish("inventory", sku, {"sku": sku, **updates})
         
-        return {"message": f"Updated {result.modified_count} items"}
+        return {"message": f"Updated {modified} items"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -175,7 +305,8 @@ def update_inventory_item(sku: str, item: NewInventoryItem):
             "stock": item.stock,
             "minStock": item.minStock,
             "location": item.location,
-            "unitPrice": item.unitPrice
+            "unitPrice": item.unitPrice,
+            **stamp("inventory")
         }
         
         result = inventory_collection.update_one(
@@ -185,6 +316,8 @@ def update_inventory_item(sku: str, item: NewInventoryItem):
         
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Item not found")
+        bump_data_version()
+        live_broker.publish("inventory", sku, {"sku": sku, **item.dict()})
             
         return {"message": "Item updated successfully"}
     except Exception as e:
@@ -196,6 +329,9 @@ def delete_inventory_item(sku: str):
         result = inventory_collection.delete_one({"_id": ObjectId(sku)})
         if result.deleted_count == 0:
              raise HTTPException(status_code=404, detail="Item not found")
+        record_tombstone("inventory", [sku])
+        bump_data_version()
+        live_broker.publish("inventory", sku, {"sku": sku, "deleted": True}, replace=True)
         return {"message": "Item deleted"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -221,11 +357,16 @@ class AutomationRuleResponse(BaseModel):
     source_link: str
     status: str
     linked_items: List[dict] = []
+    # Filled in by price_crawler.py
+    supplier_price: Optional[float] = None
+    supplier_currency: Optional[str] = None
+    supplier_availability: Optional[str] = None
+    price_checked_at: Optional[datetime] = None
 
-@app.get("/api/automations", response_model=List[AutomationRuleResponse])
-def get_automations():
+def find_automations(query: dict):
     # FIX: "from": "inventory_collection" matches the exact name in your database.py
     pipeline = [
+        {"$match": query},
         {
             "$lookup": {
                 "from": "inventory_collection", 
@@ -235,26 +376,35 @@ def get_automations():
             }
         }
     ]
+    # FIX: using automation_collection (singular)
+    return automation_collection.aggregate(pipeline)
+
+def automation_helper(doc) -> dict:
+    doc["id"] = str(doc["_id"])
     
+    # Sanitizing linked items IDs
+    for item in doc.get("linked_items", []):
+        if "_id" in item:
+            item["_id"] = str(item["_id"])
+    
+    return AutomationRuleResponse(**doc).dict()
+
+@app.get("/api/automations", response_model=List[AutomationRuleResponse])
+def get_automations():
     rules = []
     try:
-        # FIX: using automation_collection (singular)
-        cursor = automation_collection.aggregate(pipeline)
-        for doc in cursor:
-            doc["id"] = str(doc["_id"])
-            
-            # Sanitizing linked items IDs
-            for item in doc.get("linked_items", []):
-                if "_id" in item:
-                    item["_id"] = str(item["_id"])
-            
-            rules.append(doc)
+        for doc in find_automations({}):
+            rules.append(automation_helper(doc))
         return rules
     except Exception as e:
         print(f"Error fetching automations: {e}")
         # Return empty list instead of crashing if DB is empty/erroring slightly
         return [] 
 
+@app.get("/api/automations/changes")
+def get_automation_changes(since: Optional[str] = None):
+    return changes_since("automations", find_automations, automation_helper, since)
+
 @app.post("/api/automations")
 def create_automation(rule: NewAutomationRule):
     try:
@@ -265,7 +415,8 @@ def create_automation(rule: NewAutomationRule):
         # Adjust query based on your schema. Assuming 'sku' field exists in inventory.
         # If your inventory uses _id as SKU, use: inventory_collection.find_one({"_id": ObjectId(rule.sku)})
         
-        result = automation_collection.insert_one(rule_data)
+        result = automation_collection.insert_one({**rule_data, **stamp("automations")})
+        bump_data_version()
         
         # Return created object
         created_rule = {
@@ -283,10 +434,11 @@ def toggle_automation_status(rule_id: str, status_update: dict):
     try:
         result = automation_collection.update_one(
             {"_id": ObjectId(rule_id)},
-            {"$set": {"status": status_update.get("status")}}
+            {"$set": {"status": status_update.get("status"), **stamp("automations")}}
         )
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Rule not found")
+        bump_data_version()
         return {"message": "Status updated"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -308,8 +460,28 @@ class SummaryStats(BaseModel):
     total_inbound_30d: float
     total_outbound_30d: float
 
+def parse_range_date(value: Optional[str], name: str) -> Optional[datetime]:
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} date, expected YYYY-MM-DD")
+
 @app.get("/api/stats", response_model=SummaryStats)
-def get_stats():
+def get_stats(start: Optional[str] = None, end: Optional[str] = None):
+    if start is None and end is None:
+        return aggregate_flight.do("stats", compute_stats)
+
+    # Explicit ranges (YYYY-MM-DD) reach into the log archive when they start before its cutoff
+    start_date = parse_range_date(start, "start")
+    end_date = parse_range_date(end, "end")
+    return {
+        "total_inbound_30d": round(movement_total("in", start_date, end_date), 2),
+        "total_outbound_30d": round(movement_total("out", start_date, end_date), 2)
+    }
+
+def compute_stats():
     current_date = datetime(2026, 1, 12) 
     thirty_days_ago = (current_date - timedelta(days=30)).strftime("%Y-%m-%d")
     
@@ -334,28 +506,37 @@ def get_stats():
         "total_outbound_30d": round(outbound_total, 2)
     }
 
+def log_helper(log) -> dict:
+    return {
+        "date": log["date"],
+        "id": str(log["_id"]),
+        "item": log["item"],
+        "quantity": log["quantity"],
+        "value": log["value"],
+        "source_customer": log["source_customer"],
+        "responsible": log["responsible"],
+        "in_out": log["in_out"],
+        "total_value": log["quantity"] * log["value"]
+    }
+
 @app.get("/api/logs/{log_type}", response_model=List[LogItem])
-def get_logs(log_type: str):
+def get_logs(log_type: str, start: Optional[str] = None, end: Optional[str] = None):
     if log_type not in ['inbound', 'outbound']:
         raise HTTPException(status_code=400, detail="Invalid log type")
     
     db_type = 'in' if log_type == 'inbound' else 'out'
+
+    # Without a range only the live (hot) collection is read; archived history needs start/end
+    if start is not None or end is not None:
+        start_date = parse_range_date(start, "start")
+        end_date = parse_range_date(end, "end")
+        return [log_helper(log) for log in find_logs(db_type, start_date, end_date)]
     
     logs = []
     cursor = logs_collection.find({"in_out": db_type}).sort("date", -1)
     
     for log in cursor:
-        logs.append({
-            "date": log["date"],
-            "id": str(log["_id"]),
-            "item": log["item"],
-            "quantity": log["quantity"],
-            "value": log["value"],
-            "source_customer": log["source_customer"],
-            "responsible": log["responsible"],
-            "in_out": log["in_out"],
-            "total_value": log["quantity"] * log["value"]
-        })
+        logs.append(log_helper(log))
     
     return logs
 
@@ -367,36 +548,165 @@ class Order(BaseModel):
     tracking: str
     date: str
 
+class NewOrder(BaseModel):
+    customer: str
+    items: int
+    status: str
+    tracking: str
+    date: str
+
+def order_helper(order) -> dict:
+    return {
+        "id": str(order["_id"]),
+        "customer": order.get("customer"),
+        "items": order.get("items"),
+        "status": order.get("status"),
+        "tracking": order.get("tracking_number"),
+        "date": order.get("date")
+    }
+
 @app.get("/api/orders", response_model=List[Order])
 def get_orders():
     orders = []
     for order in orders_collection.find().sort("id", 1):
-        orders.append({
-            "id": str(order["_id"]),
-            "customer": order.get("customer"),
-            "items": order.get("items"),
-            "status": order.get("status"),
-            "tracking": order.get("tracking_number"),
-            "date": order.get("date")
-        })
+        orders.append(order_helper(order))
     return orders
 
+@app.get("/api/orders/changes")
+def get_order_changes(since: Optional[str] = None):
+    return changes_since("orders", orders_collection.find, order_helper, since)
+
+# Order writes go through order_counters so the per-status counters stay in step
+@app.post("/api/orders", response_model=Order)
+def add_order(order: NewOrder):
+    try:
+        if not order.status.strip():
+            raise HTTPException(status_code=400, detail="No status provided")
+        created_order = create_order({
+            "customer": order.customer,
+            "items": order.items,
+            "status": order.status,
+            "tracking_number": order.tracking,
+            "date": order.date,
+            **stamp("orders")
+        })
+        bump_data_version()
+        live_broker.publish("orders", str(created_order["_id"]), order_helper(created_order), replace=True)
+        return order_helper(created_order)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.put("/api/orders/{order_id}/status")
+def update_order_status(order_id: str, status_update: dict):
+    try:
+        if not isinstance(status_update.get("status"), str) or not status_update["status"].strip():
+            raise HTTPException(status_code=400, detail="No status provided")
+
+        updated_order = change_order_status(order_id, status_update["status"], stamp("orders"))
+        if updated_order is None:
+            raise HTTPException(status_code=404, detail="Order not found")
+        bump_data_version()
+        live_broker.publish("orders", order_id, {"id": order_id, "status": status_update["status"]})
+        return {"message": "Status updated"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.delete("/api/orders/{order_id}")
 def delete_order(order_id: str):
     try:
-        result = orders_collection.delete_one({"_id": ObjectId(order_id)})
-        
-        if result.deleted_count == 0:
+        if not remove_order(order_id):
             raise HTTPException(status_code=404, detail="Order not found")
+        record_tombstone("orders", [order_id])
+        bump_data_version()
+        live_broker.publish("orders", order_id, {"id": order_id, "deleted": True}, replace=True)
             
         return {"message": "Order deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- REPORT JOBS START ---
+
+class NewReportJob(BaseModel):
+    type: str
+    format: str = "csv"
+    start: Optional[str] = None  # movement_audit only, YYYY-MM-DD
+    end: Optional[str] = None
+
+class ReportJob(BaseModel):
+    id: str
+    type: str
+    format: str
+    status: str
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    rows: Optional[int] = None
+    error: Optional[str] = None
+
+def report_helper(job) -> dict:
+    return {
+        "id": str(job["_id"]),
+        "type": job["type"],
+        "format": job["format"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "finished_at": job.get("finished_at"),
+        "rows": job.get("rows"),
+        "error": job.get("error")
+    }
+
+def find_report(job_id: str):
+    job = reports_collection.find_one({"_id": ObjectId(job_id)}) if ObjectId.is_valid(job_id) else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return job
+
+@app.post("/api/reports", response_model=ReportJob, status_code=202)
+def create_report(request: NewReportJob):
+    if request.type not in REPORT_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid report type")
+    if request.format not in REPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid report format")
+    parse_range_date(request.start, "start")
+    parse_range_date(request.end, "end")
+
+    try:
+        job = report_queue.submit(request.type, request.format, {"start": request.start, "end": request.end})
+    except ReportQueueFull:
+        raise HTTPException(status_code=503, detail="Report queue is full", headers={"Retry-After": "30"})
+    return report_helper(job)
+
+@app.get("/api/reports/{job_id}", response_model=ReportJob)
+def get_report(job_id: str):
+    return report_helper(find_report(job_id))
+
+@app.get("/api/reports/{job_id}/artifact")
+def get_report_artifact(job_id: str):
+    job = find_report(job_id)
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Report is {job['status']}")
+    # Artifacts live on the rendering host's disk and may have been cleaned up or be elsewhere
+    if not os.path.isfile(job.get("artifact", "")):
+        raise HTTPException(status_code=410, detail="Report artifact is no longer available")
+    return FileResponse(
+        job["artifact"],
+        media_type=REPORT_FORMATS[job["format"]],
+        filename=f"{job['type']}_{job_id}.{job['format']}"
+    )
+
+# --- REPORT JOBS END ---
+
 # --- DASHBOARD AGGREGATION START ---
 
 @app.get("/api/dashboard")
 def get_dashboard_data():
+    # Shift-start herds share one run of the aggregation pipelines below
+    return aggregate_flight.do("dashboard", compute_dashboard_data)
+
+def compute_dashboard_data():
     try:
         # 1. SET THE ANCHOR DATE
         # We use Jan 12, 2026 (or datetime.now() if you prefer real-time)
@@ -425,7 +735,8 @@ def get_dashboard_data():
         low_stock_count = inv_stats[0]["lowStockCount"] if inv_stats else 0
         
         # --- 2. Pending Orders ---
-        pending_orders = orders_collection.count_documents({"status": {"$ne": "Shipped"}})
+        # Maintained counters (see order_counters.py) instead of a $ne scan over every order
+        pending_orders = order_kpis()["pending_orders"]
 
         # --- 3. CHART DATA (In vs Out) ---
         # Since dates are strings, we cannot use $gte range queries reliably.
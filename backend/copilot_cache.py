@@ -0,0 +1,180 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+from database import inventory_collection, logs_collection
+
+# Co-Pilot Cache Config
+ANSWER_CACHE_SIZE = int(os.getenv("COPILOT_ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("COPILOT_ANSWER_CACHE_TTL", "3600"))
+SNAPSHOT_CATEGORY_LIMIT = 25
+SNAPSHOT_LOW_STOCK_LIMIT = 20
+SNAPSHOT_TOP_MOVERS_LIMIT = 10
+HISTORY_MESSAGE_LIMIT = 10  # Earlier turns replayed to Dify when there is no conversation to continue
+
+# Same anchor date the dashboard uses for its 30-day window
+ANCHOR_DATE = datetime(2026, 1, 12)
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def as_dict(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+# --- Context Snapshot ---
+
+def build_context_snapshot() -> str:
+    category_pipeline = [
+        {"$group": {
+            "_id": "$category",
+            "items": {"$sum": 1},
+            "units": {"$sum": "$stock"},
+            "value": {"$sum": {"$multiply": ["$stock", "$unitPrice"]}}
+        }},
+        {"$sort": {"value": -1}},
+        {"$limit": SNAPSHOT_CATEGORY_LIMIT}
+    ]
+
+    low_stock_pipeline = [
+        {"$match": {"$expr": {"$lt": ["$stock", "$minStock"]}}},
+        {"$project": {
+            "name": 1, "stock": 1, "minStock": 1, "location": 1,
+            "shortfall": {"$subtract": ["$minStock", "$stock"]}
+        }},
+        {"$sort": {"shortfall": -1}},
+        {"$limit": SNAPSHOT_LOW_STOCK_LIMIT}
+    ]
+
+    target_dates = [(ANCHOR_DATE - timedelta(days=i)).strftime("%d/%m/%Y") for i in range(30)]
+    top_movers_pipeline = [
+        {"$match": {"in_out": "out", "date": {"$in": target_dates}}},
+        {"$group": {"_id": "$item", "totalQty": {"$sum": "$quantity"}}},
+        {"$sort": {"totalQty": -1}},
+        {"$limit": SNAPSHOT_TOP_MOVERS_LIMIT}
+    ]
+
+    lines = ["Category totals (items | units | value):"]
+    for doc in inventory_collection.aggregate(category_pipeline):
+        lines.append(f"- {doc['_id']}: {doc['items']} | {doc['units']} | ${doc['value']:,.2f}")
+
+    lines.append("Low stock (stock/min @ location):")
+    for doc in inventory_collection.aggregate(low_stock_pipeline):
+        lines.append(f"- {doc.get('name')} [{doc['_id']}]: {doc.get('stock')}/{doc.get('minStock')} @ {doc.get('location')}")
+
+    lines.append("Top movers, last 30 days (units out):")
+    for doc in logs_collection.aggregate(top_movers_pipeline):
+        lines.append(f"- {doc['_id']}: {doc['totalQty']}")
+
+    return "\n".join(lines)
+
+
+class ContextSnapshot:
+    """Compact inventory summary handed to Dify, rebuilt only when the data version moves."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._text = ""
+        self.stats = CacheStats()
+
+    def get(self, data_version: int) -> str:
+        with self._lock:
+            if self._version == data_version:
+                self.stats.hits += 1
+                return self._text
+
+            self.stats.misses += 1
+            self._text = build_context_snapshot()
+            self._version = data_version
+            return self._text
+
+
+def conversation_turns(messages) -> list:
+    # Drops leading assistant-only turns, such as the chat UI's canned greeting
+    for i, message in enumerate(messages):
+        if message.role == "user":
+            return messages[i:]
+    return []
+
+
+def is_opening_question(messages) -> bool:
+    return sum(1 for message in messages if message.role == "user") == 1
+
+
+def query_with_history(messages) -> str:
+    """The last message, prefixed with the earlier turns the client sent.
+
+    Used when there is no Dify conversation to continue (e.g. the previous turn
+    was served from the answer cache), so a follow-up keeps its context.
+    """
+    earlier = conversation_turns(messages)[:-1][-HISTORY_MESSAGE_LIMIT:]
+    if not earlier:
+        return messages[-1].content
+    transcript = "\n".join(f"{message.role}: {message.content}" for message in earlier)
+    return f"Earlier in this conversation:\n{transcript}\n\nQuestion: {messages[-1].content}"
+
+
+# --- Answer Cache ---
+
+def normalize_query(query: str) -> str:
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return " ".join(query.split())
+
+
+class AnswerCache:
+    """LRU of Co-Pilot answers keyed by normalized query and data version."""
+
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = CacheStats()
+
+    def get(self, query: str, data_version: int) -> Optional[str]:
+        key = (normalize_query(query), data_version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.stats.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry[0]
+
+    def put(self, query: str, data_version: int, answer: str):
+        key = (normalize_query(query), data_version)
+        with self._lock:
+            self._entries[key] = (answer, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+context_snapshot = ContextSnapshot()
+answer_cache = AnswerCache()
+
+
+def copilot_metrics() -> dict:
+    return {
+        "context_snapshot": context_snapshot.stats.as_dict(),
+        "answer_cache": {**answer_cache.stats.as_dict(), "size": len(answer_cache)}
+    }
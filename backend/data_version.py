@@ -0,0 +1,22 @@
+from pymongo import ReturnDocument
+from database import job_state_collection
+
+# A single monotonically increasing stamp bumped by every write handler.
+# Caches key on it so that any change to inventory, orders, logs or
+# automations invalidates them without having to know what changed.
+DATA_VERSION_ID = "data_version"
+
+
+def current_data_version() -> int:
+    doc = job_state_collection.find_one({"_id": DATA_VERSION_ID}, {"version": 1})
+    return doc["version"] if doc else 0
+
+
+def bump_data_version() -> int:
+    doc = job_state_collection.find_one_and_update(
+        {"_id": DATA_VERSION_ID},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return doc["version"]
@@ -32,8 +32,14 @@ database = client[DATABASE_NAME]
 
 inventory_collection = database.get_collection("inventory_collection")
 logs_collection = database.get_collection("logs_collection")
+logs_archive_collection = database.get_collection("logs_archive_collection")
 orders_collection = database.get_collection("orders_collection")
+order_counters_collection = database.get_collection("order_counters_collection")
 automation_collection = database.get_collection("automation_collection")
+job_state_collection = database.get_collection("job_state_collection")
+tombstones_collection = database.get_collection("tombstones_collection")
+reports_collection = database.get_collection("reports_collection")
+crawl_cache_collection = database.get_collection("crawl_cache_collection")
 
 def test_connection():
     try:
@@ -0,0 +1,125 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, List, Optional
+from fastapi import HTTPException
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from database import (
+    inventory_collection, orders_collection, automation_collection,
+    job_state_collection, tombstones_collection
+)
+
+# Delta Sync Config
+# Writes must land within SETTLE_SECONDS of reserving their version; cursors only advance past
+# versions older than that, so a slow writer holding a lower version is never skipped.
+SETTLE_SECONDS = float(os.getenv("SYNC_SETTLE_SECONDS", "5"))
+TOMBSTONE_TTL_DAYS = int(os.getenv("SYNC_TOMBSTONE_TTL_DAYS", "30"))
+# Bulk writes take a fresh version per chunk, sized to finish well inside SETTLE_SECONDS
+WRITE_CHUNK_SIZE = int(os.getenv("SYNC_WRITE_CHUNK_SIZE", "1000"))
+
+SYNCED_COLLECTIONS = {
+    "inventory": inventory_collection,
+    "orders": orders_collection,
+    "automations": automation_collection,
+}
+
+
+def ensure_sync_indexes():
+    for collection in SYNCED_COLLECTIONS.values():
+        collection.create_index([("_v", ASCENDING)])
+    tombstones_collection.create_index([("collection", ASCENDING), ("_v", ASCENDING)])
+    tombstones_collection.create_index("updatedAt", expireAfterSeconds=TOMBSTONE_TTL_DAYS * 86400)
+
+
+def utc_now() -> datetime:
+    # Naive UTC, the same form pymongo returns stored datetimes in
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# --- Write Side ---
+
+def stamp(name: str) -> dict:
+    """Reserve the next version of a synced collection; merge the result into the write's $set."""
+    counter = job_state_collection.find_one_and_update(
+        {"_id": f"sync_version:{name}"},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return {"_v": counter["version"], "updatedAt": utc_now()}
+
+
+def stamped_bulk_write(name: str, updates: List[tuple], chunk_size: int = WRITE_CHUNK_SIZE) -> int:
+    """`$set` each (_id, fields) pair in chunks, each chunk under its own version.
+
+    A single version for a long bulk write would settle before the write
+    finished, and a client polling mid-write would skip the rest of it.
+    Returns the number of documents modified.
+    """
+    collection = SYNCED_COLLECTIONS[name]
+    modified = 0
+    for start in range(0, len(updates), chunk_size):
+        version = stamp(name)
+        result = collection.bulk_write([
+            UpdateOne({"_id": doc_id}, {"$set": {**fields, **version}})
+            for doc_id, fields in updates[start:start + chunk_size]
+        ], ordered=False)
+        modified += result.modified_count
+    return modified
+
+
+def record_tombstone(name: str, doc_ids: Iterable[str]):
+    version = stamp(name)
+    tombstones_collection.insert_many([
+        {"collection": name, "doc_id": str(doc_id), **version} for doc_id in doc_ids
+    ])
+
+
+# --- Read Side ---
+
+def encode_cursor(version: int, issued: datetime) -> str:
+    return f"{version}.{int(issued.replace(tzinfo=timezone.utc).timestamp())}"
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        version, issued = cursor.split(".")
+        return int(version), datetime.fromtimestamp(int(issued), timezone.utc).replace(tzinfo=None)
+    except (ValueError, OverflowError, OSError):
+        # Out-of-range timestamps overflow datetime rather than failing to parse
+        raise HTTPException(status_code=400, detail="Invalid sync cursor")
+
+
+def changes_since(name: str, fetch: Callable[[dict], Iterable[dict]], helper: Callable[[dict], dict],
+                  cursor: Optional[str]) -> dict:
+    """Documents of `name` changed after `cursor`, plus ids deleted since then.
+
+    Without a cursor, or with one older than the tombstone retention, the full
+    collection is returned with `reset` set so the client replaces its replica.
+    Changes newer than the settle window may be returned again on the next
+    poll; clients apply them idempotently by id.
+    """
+    now = utc_now()
+    since = None
+    if cursor:
+        since, issued = decode_cursor(cursor)
+        if now - issued > timedelta(days=TOMBSTONE_TTL_DAYS):
+            since = None
+
+    reset = since is None
+    docs = list(fetch({} if reset else {"_v": {"$gt": since}}))
+    tombstones = [] if reset else list(tombstones_collection.find(
+        {"collection": name, "_v": {"$gt": since}}, {"doc_id": 1, "_v": 1, "updatedAt": 1}
+    ))
+
+    settled_before = now - timedelta(seconds=SETTLE_SECONDS)
+    next_version = since or 0
+    for entry in docs + tombstones:
+        if entry.get("updatedAt") and entry["updatedAt"] <= settled_before:
+            next_version = max(next_version, entry.get("_v", 0))
+
+    return {
+        "changes": [helper(doc) for doc in docs],
+        "deleted": [entry["doc_id"] for entry in tombstones],
+        "cursor": encode_cursor(next_version, now),
+        "reset": reset
+    }
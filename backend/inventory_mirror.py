@@ -0,0 +1,299 @@
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional
+from pymongo.errors import PyMongoError
+from database import inventory_collection
+from delta_sync import changes_since
+
+# Inventory Mirror Config
+MIRROR_ENABLED = os.getenv("INVENTORY_MIRROR", "0") == "1"
+MIRROR_POLL_INTERVAL = float(os.getenv("INVENTORY_MIRROR_POLL_INTERVAL", "2"))
+
+MISSING = -1  # Stored in integer columns for absent minStock / safetyStock / reorderPoint
+PROJECTION = {"name": 1, "category": 1, "location": 1, "stock": 1, "minStock": 1,
+              "unitPrice": 1, "safetyStock": 1, "reorderPoint": 1}
+
+
+class Interner:
+    """Maps repeated strings (categories, locations) to small integer codes."""
+
+    __slots__ = ("values", "codes")
+
+    def __init__(self):
+        self.values: List[Optional[str]] = []
+        self.codes: Dict[Optional[str], int] = {}
+
+    def code(self, value: Optional[str]) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def optional_int(value) -> int:
+    return MISSING if value is None else int(value)
+
+
+class InventoryMirror:
+    """Column-oriented, in-process copy of inventory_collection.
+
+    Each field is a typed `array` (or a list for free text), rows are addressed
+    through an `_id` -> row index, and categories/locations are interned codes
+    with sorted row-number arrays as secondary indexes (4 bytes per row each,
+    rather than a set entry plus an int object). Deletes swap the last row into
+    the hole so the columns stay dense. Kept current by a change stream, or by
+    polling the delta-sync feed when change streams aren't available.
+    """
+
+    __slots__ = ("_lock", "ids", "names", "category_codes", "location_codes", "stock", "min_stock",
+                 "unit_price", "safety_stock", "reorder_point", "row_of", "categories", "locations",
+                 "by_category", "by_location", "ready", "mode")
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.ids: List[str] = []
+        self.names: List[Optional[str]] = []
+        self.category_codes = array("I")
+        self.location_codes = array("I")
+        self.stock = array("q")
+        self.min_stock = array("q")
+        self.unit_price = array("d")
+        self.safety_stock = array("q")
+        self.reorder_point = array("q")
+        self.row_of: Dict[str, int] = {}
+        self.categories = Interner()
+        self.locations = Interner()
+        self.by_category: Dict[int, array] = {}
+        self.by_location: Dict[int, array] = {}
+        self.ready = False
+        self.mode = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    # --- Mutation ---
+
+    def upsert(self, doc: dict):
+        sku = str(doc["_id"])
+        with self._lock:
+            category = self.categories.code(doc.get("category"))
+            location = self.locations.code(doc.get("location"))
+            row = self.row_of.get(sku)
+            if row is None:
+                row = len(self.ids)
+                self.row_of[sku] = row
+                self.ids.append(sku)
+                self.names.append(doc.get("name"))
+                self.category_codes.append(category)
+                self.location_codes.append(location)
+                self.stock.append(int(doc.get("stock") or 0))
+                self.min_stock.append(optional_int(doc.get("minStock")))
+                self.unit_price.append(float(doc.get("unitPrice") or 0.0))
+                self.safety_stock.append(optional_int(doc.get("safetyStock")))
+                self.reorder_point.append(optional_int(doc.get("reorderPoint")))
+            else:
+                self._unindex(row)
+                self.names[row] = doc.get("name")
+                self.category_codes[row] = category
+                self.location_codes[row] = location
+                self.stock[row] = int(doc.get("stock") or 0)
+                self.min_stock[row] = optional_int(doc.get("minStock"))
+                self.unit_price[row] = float(doc.get("unitPrice") or 0.0)
+                self.safety_stock[row] = optional_int(doc.get("safetyStock"))
+                self.reorder_point[row] = optional_int(doc.get("reorderPoint"))
+            self._index(row)
+
+    def delete(self, sku: str):
+        with self._lock:
+            row = self.row_of.pop(sku, None)
+            if row is None:
+                return
+            self._unindex(row)
+            last = len(self.ids) - 1
+            if row != last:
+                self._unindex(last)
+                for column in self._columns():
+                    column[row] = column[last]
+                self.row_of[self.ids[row]] = row
+                self._index(row)
+            for column in self._columns():
+                column.pop()
+
+    def _columns(self):
+        return (self.ids, self.names, self.category_codes, self.location_codes, self.stock,
+                self.min_stock, self.unit_price, self.safety_stock, self.reorder_point)
+
+    def _index(self, row: int):
+        insort(self.by_category.setdefault(self.category_codes[row], array("I")), row)
+        insort(self.by_location.setdefault(self.location_codes[row], array("I")), row)
+
+    def _unindex(self, row: int):
+        for rows in (self.by_category[self.category_codes[row]], self.by_location[self.location_codes[row]]):
+            del rows[bisect_left(rows, row)]
+
+    # --- Reads ---
+
+    def _item(self, row: int) -> dict:
+        # Same shape as backend.inventory_helper
+        stock = self.stock[row]
+        unit_price = self.unit_price[row]
+        min_stock = self.min_stock[row]
+        safety_stock = self.safety_stock[row]
+        reorder_point = self.reorder_point[row]
+        return {
+            "sku": self.ids[row],
+            "name": self.names[row],
+            "category": self.categories.values[self.category_codes[row]],
+            "stock": stock,
+            "minStock": None if min_stock == MISSING else min_stock,
+            "location": self.locations.values[self.location_codes[row]],
+            "unitPrice": unit_price,
+            "totalValue": f"${stock * unit_price:,.2f}",
+            "safetyStock": None if safety_stock == MISSING else safety_stock,
+            "reorderPoint": None if reorder_point == MISSING else reorder_point
+        }
+
+    def get(self, sku: str) -> Optional[dict]:
+        with self._lock:
+            row = self.row_of.get(sku)
+            return None if row is None else self._item(row)
+
+    def items(self, category: Optional[str] = None, location: Optional[str] = None,
+              low_stock: bool = False) -> List[dict]:
+        with self._lock:
+            category_code = self.categories.codes.get(category, MISSING)
+            location_code = self.locations.codes.get(location, MISSING)
+            if category is not None:
+                rows = self.by_category.get(category_code, ())
+                if location is not None:
+                    rows = [row for row in rows if self.location_codes[row] == location_code]
+            elif location is not None:
+                rows = self.by_location.get(location_code, ())
+            else:
+                rows = range(len(self.ids))
+            if low_stock:
+                rows = [row for row in rows if self.min_stock[row] != MISSING and self.stock[row] < self.min_stock[row]]
+            return [self._item(row) for row in rows]
+
+    # --- Sync ---
+
+    def start(self):
+        try:
+            # Opened before the initial load so nothing written during the load is missed
+            stream = inventory_collection.watch(full_document="updateLookup")
+        except PyMongoError as e:
+            print(f"Inventory mirror: change streams unavailable ({e}), polling instead")
+            snapshot = changes_since("inventory", inventory_collection.find, lambda doc: doc, None)
+            for doc in snapshot["changes"]:
+                self.upsert(doc)
+            self.mode = "polling"
+            self.ready = True
+            threading.Thread(target=self._poll, args=(snapshot["cursor"],), daemon=True).start()
+            return
+
+        for doc in inventory_collection.find({}, PROJECTION):
+            self.upsert(doc)
+        self.mode = "change_stream"
+        self.ready = True
+        threading.Thread(target=self._follow, args=(stream,), daemon=True).start()
+
+    def _follow(self, stream):
+        reason = "change stream ended"  # e.g. an invalidate event after a drop or rename
+        try:
+            with stream:
+                for change in stream:
+                    if change["operationType"] == "delete":
+                        self.delete(str(change["documentKey"]["_id"]))
+                    elif change.get("fullDocument") is not None:
+                        self.upsert(change["fullDocument"])
+        except Exception as e:
+            reason = f"change stream failed ({e})"
+        finally:
+            # However the thread ends, a mirror that stopped following writes must not
+            # serve reads; a stale mirror is worse than none, so fall back to the database
+            self.ready = False
+            print(f"Inventory mirror: {reason}, mirror disabled")
+
+    def _poll(self, cursor: str):
+        reason = "delta-sync cursor expired"
+        try:
+            while True:
+                time.sleep(MIRROR_POLL_INTERVAL)
+                try:
+                    delta = changes_since("inventory", inventory_collection.find, lambda doc: doc, cursor)
+                except PyMongoError as e:
+                    print(f"Inventory mirror poll failed: {e}")
+                    continue
+                if delta["reset"]:
+                    return
+                for doc in delta["changes"]:
+                    self.upsert(doc)
+                for sku in delta["deleted"]:
+                    self.delete(sku)
+                cursor = delta["cursor"]
+        except Exception as e:
+            reason = f"polling failed ({e})"
+        finally:
+            self.ready = False
+            print(f"Inventory mirror: {reason}, mirror disabled")
+
+    def metrics(self) -> dict:
+        return {"ready": self.ready, "mode": self.mode, "rows": len(self),
+                "categories": len(self.categories.values), "locations": len(self.locations.values)}
+
+
+inventory_mirror = InventoryMirror()
+
+
+def benchmark(count: int):
+    """Memory per SKU of the mirror vs. the list of BSON-decoded dicts it replaces."""
+    import random
+    import tracemalloc
+    from bson import ObjectId
+
+    categories = [f"Category {i}" for i in range(200)]
+    locations = [f"Warehouse {i}" for i in range(50)]
+
+    def docs():
+        for i in range(count):
+            yield {"_id": ObjectId(), "name": f"Item {i:07d}", "category": random.choice(categories),
+                   "stock": random.randint(0, 1000), "minStock": random.randint(0, 300),
+                   "location": random.choice(locations), "unitPrice": round(random.uniform(1, 500), 2),
+                   "safetyStock": random.randint(0, 100), "reorderPoint": random.randint(0, 400)}
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    as_dicts = list(docs())
+    dict_bytes = tracemalloc.get_traced_memory()[0] - base
+    del as_dicts
+
+    base = tracemalloc.get_traced_memory()[0]
+    mirror = InventoryMirror()
+    for doc in docs():
+        mirror.upsert(doc)
+    mirror_bytes = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    low = mirror.items(low_stock=True)
+    low_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    for sku in mirror.ids[:10000]:
+        mirror.get(sku)
+    get_us = (time.perf_counter() - started) / min(count, 10000) * 1e6
+
+    print(f"SKUs:                 {count:,}")
+    print(f"list of dicts:        {dict_bytes / count:,.0f} bytes/SKU ({dict_bytes / 2**20:,.1f} MiB)")
+    print(f"mirror:               {mirror_bytes / count:,.0f} bytes/SKU ({mirror_bytes / 2**20:,.1f} MiB)")
+    print(f"low-stock filter:     {low_ms:,.1f} ms ({len(low):,} rows)")
+    print(f"single-SKU lookup:    {get_us:,.2f} us")
+
+
+if __name__ == "__main__":
+    # `python inventory_mirror.py [count]` runs the memory benchmark on synthetic SKUs
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,224 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Set
+from pymongo.errors import OperationFailure
+
+# Live Updates Config
+COALESCE_INTERVAL = float(os.getenv("LIVE_COALESCE_INTERVAL", "1"))
+KPI_INTERVAL = float(os.getenv("LIVE_KPI_INTERVAL", "5"))
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "16"))  # Frames buffered per client
+MAX_SLOW_STRIKES = 3
+MAX_SUBSCRIBERS = int(os.getenv("LIVE_MAX_SUBSCRIBERS", "5000"))
+MOVEMENT_BUMP_INTERVAL = float(os.getenv("LIVE_MOVEMENT_BUMP_INTERVAL", "5"))  # Min seconds between on_insert calls
+WATCH_RETRY_MAX_DELAY = 60  # Seconds between change stream reconnect attempts, at most
+CHANGE_STREAMS_UNSUPPORTED = 40573  # Server error code on a standalone mongod
+CHANGE_STREAM_HISTORY_LOST = 286  # The resume token fell off the oplog
+
+TOPICS = {"inventory", "movements", "orders", "kpis"}
+KPI_TRIGGER_TOPICS = {"inventory", "movements", "orders"}
+
+
+class Subscriber:
+    def __init__(self, topics: Set[str]):
+        self.topics = topics
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.strikes = 0
+        self.closed = False
+
+
+class LiveBroker:
+    """Fans change events out to SSE subscribers, coalesced into one frame per topic per interval.
+
+    `publish` is safe to call from sync handlers running in the threadpool.
+    Updates for the same key within an interval are merged, each frame is
+    serialized once for all subscribers, and a subscriber whose queue is full
+    gets its backlog replaced by a single `resync` frame (it should refetch via
+    the delta-sync endpoints). Repeat offenders are disconnected.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Dict[str, dict]] = {}
+        self.subscribers: Set[Subscriber] = set()
+        self.kpi_source: Optional[Callable[[], dict]] = None
+        self._last_kpis: dict = {}
+        self._last_kpi_run = 0.0
+        self._kpis_dirty = False
+        self._kpi_task = None
+        self._task = None
+        self.counters = {"published": 0, "frames": 0, "deliveries": 0, "resyncs": 0, "slow_disconnects": 0}
+
+    # --- Publishing ---
+
+    def publish(self, topic: str, key: str, payload: dict, replace: bool = False):
+        with self._lock:
+            updates = self._pending.setdefault(topic, {})
+            if replace or key not in updates:
+                updates[key] = payload
+            else:
+                updates[key] = {**updates[key], **payload}
+            self.counters["published"] += 1
+
+    # --- Subscribing ---
+
+    def subscribe(self, topics: Iterable[str]) -> Optional[Subscriber]:
+        if len(self.subscribers) >= MAX_SUBSCRIBERS:
+            return None
+        subscriber = Subscriber(set(topics) & TOPICS)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscriber.closed = True
+        self.subscribers.discard(subscriber)
+
+    async def frames(self, subscriber: Subscriber):
+        try:
+            while True:
+                frame = await subscriber.queue.get()
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            self.unsubscribe(subscriber)
+
+    def _deliver(self, subscriber: Subscriber, frame: dict):
+        try:
+            subscriber.queue.put_nowait(frame)
+            self.counters["deliveries"] += 1
+            return
+        except asyncio.QueueFull:
+            pass
+
+        # Slow consumer: drop its backlog and tell it to resync instead
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.strikes += 1
+        if subscriber.strikes >= MAX_SLOW_STRIKES:
+            self.counters["slow_disconnects"] += 1
+            self.subscribers.discard(subscriber)
+            subscriber.queue.put_nowait(None)
+            return
+        self.counters["resyncs"] += 1
+        subscriber.queue.put_nowait({"event": "resync", "data": json.dumps({"topics": sorted(subscriber.topics)})})
+
+    # --- Flush Loop ---
+
+    def start(self, kpi_source: Optional[Callable[[], dict]] = None):
+        self.kpi_source = kpi_source
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(COALESCE_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Live update flush error: {e}")
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        for topic, updates in pending.items():
+            listeners = [s for s in self.subscribers if topic in s.topics]
+            if not listeners:
+                continue
+            frame = {"event": topic, "data": json.dumps({"updates": list(updates.values())}, default=str)}
+            self.counters["frames"] += 1
+            for subscriber in listeners:
+                self._deliver(subscriber, frame)
+
+        if KPI_TRIGGER_TOPICS & set(pending):
+            self._kpis_dirty = True
+        if self._kpis_dirty:
+            self._maybe_refresh_kpis()
+
+    def _maybe_refresh_kpis(self):
+        # Stays dirty until a refresh actually starts, so throttled changes are picked up later
+        if self.kpi_source is None or (self._kpi_task and not self._kpi_task.done()):
+            return
+        if time.monotonic() - self._last_kpi_run < KPI_INTERVAL:
+            return
+        if not any("kpis" in s.topics for s in self.subscribers):
+            return
+        self._kpis_dirty = False
+        self._last_kpi_run = time.monotonic()
+        self._kpi_task = asyncio.get_running_loop().create_task(self._refresh_kpis())
+
+    async def _refresh_kpis(self):
+        try:
+            kpis = await asyncio.to_thread(self.kpi_source)
+        except Exception as e:
+            print(f"Live KPI refresh error: {e}")
+            return
+        delta = {key: value for key, value in kpis.items() if self._last_kpis.get(key) != value}
+        self._last_kpis = kpis
+        if delta:
+            self.publish("kpis", "dashboard", delta)
+
+    def metrics(self) -> dict:
+        queued = [s.queue.qsize() for s in self.subscribers]
+        return {
+            **self.counters,
+            "subscribers": len(self.subscribers),
+            "max_queue_depth": max(queued) if queued else 0
+        }
+
+
+live_broker = LiveBroker()
+
+
+def watch_movements(logs_collection, on_insert: Optional[Callable[[], object]] = None):
+    """Publish inserted log movements from a change stream (needs a replica set, e.g. Atlas).
+
+    Movements are written outside the API, so `on_insert` (the data-version bump)
+    is how caches keyed on the data version learn about them. It is debounced
+    to one call per MOVEMENT_BUMP_INTERVAL, so a bulk import costs one write
+    per interval rather than one per movement.
+    """
+    changed = threading.Event()
+
+    def bump():
+        while True:
+            changed.wait()
+            time.sleep(MOVEMENT_BUMP_INTERVAL)  # Let the rest of a burst arrive first
+            changed.clear()
+            try:
+                on_insert()
+            except Exception as e:
+                print(f"Movement data-version bump failed: {e}")
+                changed.set()
+
+    def run():
+        resume_token = None
+        delay = 1
+        while True:
+            try:
+                with logs_collection.watch([{"$match": {"operationType": "insert"}}],
+                                           resume_after=resume_token) as stream:
+                    delay = 1
+                    for change in stream:
+                        log = change["fullDocument"]
+                        live_broker.publish("movements", str(log["_id"]), {**log, "_id": str(log["_id"])})
+                        changed.set()
+                        resume_token = stream.resume_token
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    print(f"Movement change stream unavailable: {e}")
+                    return
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    # Movements in the gap are missed; clients catch up on their next resync
+                    resume_token = None
+                print(f"Movement change stream error, retrying in {delay}s: {e}")
+            except Exception as e:
+                print(f"Movement change stream error, retrying in {delay}s: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, WATCH_RETRY_MAX_DELAY)
+
+    threading.Thread(target=run, daemon=True).start()
+    if on_insert is not None:
+        threading.Thread(target=bump, daemon=True).start()
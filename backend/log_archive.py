@@ -0,0 +1,234 @@
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+from pymongo import ASCENDING, ReplaceOne
+from database import database, logs_collection, logs_archive_collection, job_state_collection
+from data_version import bump_data_version
+
+# Archive Config
+# Keep this wider than the dashboard (30d) and replenishment (DEMAND_WINDOW_DAYS) windows,
+# which only ever read the live collection
+ARCHIVE_HORIZON_DAYS = int(os.getenv("ARCHIVE_HORIZON_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = 10000  # Keep a multiple of BUCKET_SIZE so bucket ids are stable across re-runs
+BUCKET_SIZE = 1000  # Movements per archive document, well under the 16MB document limit
+MAX_DATE_LIST_DAYS = 400  # Ranges up to this long are matched with an indexed $in of date strings
+
+JOB_ID = "log_archive"
+DAY_FORMAT = "%Y-%m-%d"  # Archive partitions use ISO days so they sort and range-scan
+LOG_DATE_FORMAT = "%d/%m/%Y"  # Format of `date` in logs_collection
+
+# Live log dates are dd/mm/yyyy strings, so open-ended range filters have to parse them
+# server-side. Malformed dates parse to null and are left out of ranged queries.
+PARSED_LOG_DATE = {"$dateFromString": {"dateString": "$date", "format": LOG_DATE_FORMAT,
+                                       "onError": None, "onNull": None}}
+
+
+def ensure_archive_collection():
+    if "logs_archive_collection" not in database.list_collection_names():
+        database.create_collection(
+            "logs_archive_collection",
+            storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}}
+        )
+    logs_archive_collection.create_index([("in_out", ASCENDING), ("day", ASCENDING)])
+
+
+def ensure_log_indexes():
+    # Serves the $in date lists of ranged queries and the archive job's per-day batches
+    logs_collection.create_index([("date", ASCENDING), ("_id", ASCENDING)])
+
+
+def archive_cutoff() -> Optional[datetime]:
+    # Everything strictly before this day lives in the archive
+    state = job_state_collection.find_one({"_id": JOB_ID}, {"archived_before": 1})
+    return state["archived_before"] if state else None
+
+
+def live_range_filter(start: Optional[datetime], end: Optional[datetime], cutoff: Optional[datetime]) -> dict:
+    # Days before the cutoff are read from the archive only, even while the archive job
+    # is still deleting their live copies, so nothing is missed or counted twice
+    if cutoff is not None and (start is None or start < cutoff):
+        start = cutoff
+
+    if start is not None and end is not None and (end - start).days < MAX_DATE_LIST_DAYS:
+        days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+        return {"date": {"$in": [day.strftime(LOG_DATE_FORMAT) for day in days]}}
+
+    conditions = []
+    if start is not None:
+        conditions.append({"$gte": [PARSED_LOG_DATE, start]})
+    if end is not None:
+        conditions.append({"$lte": [PARSED_LOG_DATE, end]})
+        conditions.append({"$ne": [PARSED_LOG_DATE, None]})  # null sorts below every date
+    return {"$expr": {"$and": conditions}} if conditions else {}
+
+
+def log_sort_key(log: dict) -> datetime:
+    try:
+        return datetime.strptime(log["date"], LOG_DATE_FORMAT)
+    except (KeyError, TypeError, ValueError):
+        return datetime.min
+
+
+def archive_range_filter(in_out: str, start: Optional[datetime], end: Optional[datetime], cutoff: datetime) -> dict:
+    # Partition pruning: only buckets whose day falls inside the requested range
+    day_range = {"$lt": cutoff.strftime(DAY_FORMAT)}
+    if start is not None:
+        day_range["$gte"] = start.strftime(DAY_FORMAT)
+    if end is not None:
+        day_range["$lte"] = end.strftime(DAY_FORMAT)
+    return {"in_out": in_out, "day": day_range}
+
+
+def needs_archive(start: Optional[datetime], cutoff: Optional[datetime]) -> bool:
+    return cutoff is not None and (start is None or start < cutoff)
+
+
+# --- Queries ---
+
+def find_logs(in_out: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+    """Movements of one direction within [start, end], newest first, from live and archived data."""
+    cutoff = archive_cutoff()
+    logs = list(logs_collection.find({"in_out": in_out, **live_range_filter(start, end, cutoff)}))
+
+    if needs_archive(start, cutoff):
+        for bucket in logs_archive_collection.find(archive_range_filter(in_out, start, end, cutoff)):
+            for movement in bucket["movements"]:
+                logs.append({**movement, "in_out": in_out})
+
+    logs.sort(key=log_sort_key, reverse=True)
+    return logs
+
+
+def movement_total(in_out: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> float:
+    cutoff = archive_cutoff()
+    pipeline = [
+        {"$match": {"in_out": in_out, **live_range_filter(start, end, cutoff)}},
+        {"$group": {"_id": None, "total": {"$sum": {"$multiply": ["$quantity", "$value"]}}}}
+    ]
+    result = list(logs_collection.aggregate(pipeline))
+    total = result[0]["total"] if result else 0.0
+
+    if needs_archive(start, cutoff):
+        # Buckets carry precomputed totals, so archived ranges never unwind movements
+        archive_pipeline = [
+            {"$match": archive_range_filter(in_out, start, end, cutoff)},
+            {"$group": {"_id": None, "total": {"$sum": "$total_value"}}}
+        ]
+        result = list(logs_archive_collection.aggregate(archive_pipeline))
+        total += result[0]["total"] if result else 0.0
+
+    return total
+
+
+# --- Archive Job ---
+
+def build_buckets(batch: List[dict]) -> List[ReplaceOne]:
+    partitions = {}
+    for log in batch:
+        day = datetime.strptime(log["date"], LOG_DATE_FORMAT).strftime(DAY_FORMAT)
+        partitions.setdefault((day, log["in_out"]), []).append(log)
+
+    operations = []
+    for (day, in_out), logs in partitions.items():
+        for start in range(0, len(logs), BUCKET_SIZE):
+            chunk = logs[start:start + BUCKET_SIZE]
+            movements = [{k: v for k, v in log.items() if k != "in_out"} for log in chunk]
+            # Deterministic _id so re-running after a crash overwrites instead of duplicating
+            bucket_id = f"{day}:{in_out}:{chunk[0]['_id']}"
+            operations.append(ReplaceOne({"_id": bucket_id}, {
+                "_id": bucket_id,
+                "day": day,
+                "in_out": in_out,
+                "count": len(chunk),
+                "quantity": sum(log["quantity"] for log in chunk),
+                "total_value": sum(log["quantity"] * log["value"] for log in chunk),
+                "movements": movements
+            }, upsert=True))
+    return operations
+
+
+def pending_days(before: datetime) -> List[datetime]:
+    days = []
+    for value in logs_collection.distinct("date"):
+        try:
+            day = datetime.strptime(value, LOG_DATE_FORMAT)
+        except (TypeError, ValueError):
+            continue  # Malformed dates stay live; they can't be partitioned
+        if day < before:
+            days.append(day)
+    return sorted(days)
+
+
+def archive_day(day: datetime) -> Optional[tuple]:
+    """Write the buckets for one day's live movements; returns (count, last _id) or None."""
+    query = {"date": day.strftime(LOG_DATE_FORMAT)}
+    count = 0
+    last_id = None
+    while True:
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(logs_collection.find(query).sort("_id", ASCENDING).limit(ARCHIVE_BATCH_SIZE))
+        if not batch:
+            break
+        logs_archive_collection.bulk_write(build_buckets(batch), ordered=False)
+        count += len(batch)
+        last_id = batch[-1]["_id"]
+    return (count, last_id) if count else None
+
+
+def finish_pending_delete():
+    # A run interrupted between moving the cutoff and deleting the live copies
+    state = job_state_collection.find_one({"_id": JOB_ID}, {"deleting": 1}) or {}
+    pending = state.get("deleting")
+    if pending:
+        logs_collection.delete_many({"date": pending["date"], "_id": {"$lte": pending["last_id"]}})
+        job_state_collection.update_one({"_id": JOB_ID}, {"$unset": {"deleting": ""}})
+
+
+def run_archive_job(as_of: Optional[datetime] = None, horizon_days: int = ARCHIVE_HORIZON_DAYS) -> dict:
+    """Move live movements older than the horizon into the archive, one day at a time.
+
+    Each day goes through three steps: its buckets are written (readers still
+    use the live copies), the cutoff moves past it (readers switch to the
+    buckets), then the live copies are deleted. A crash at any point leaves
+    readers with exactly one copy of every movement.
+    """
+    as_of = as_of or datetime.now()
+    target = datetime(as_of.year, as_of.month, as_of.day) - timedelta(days=horizon_days)
+    ensure_archive_collection()
+    ensure_log_indexes()
+    finish_pending_delete()
+
+    archived = 0
+    for day in pending_days(target):
+        cutoff = archive_cutoff()
+        if cutoff is None or day >= cutoff:
+            # No reader sees buckets at or past the cutoff; clear any left by an interrupted run
+            logs_archive_collection.delete_many({"day": day.strftime(DAY_FORMAT)})
+        written = archive_day(day)
+        if written is None:
+            continue
+        count, last_id = written
+
+        # The cutoff never moves backwards, even if the horizon is widened later
+        next_day = day + timedelta(days=1)
+        state = {"deleting": {"date": day.strftime(LOG_DATE_FORMAT), "last_id": last_id}, "last_run": as_of}
+        if cutoff is None or next_day > cutoff:
+            state["archived_before"] = next_day
+        job_state_collection.update_one({"_id": JOB_ID}, {"$set": state}, upsert=True)
+
+        # Only movements that made it into a bucket; later backdated inserts wait for the next run
+        finish_pending_delete()
+        archived += count
+
+    if archived:
+        bump_data_version()
+
+    cutoff = archive_cutoff()
+    return {"archived": archived, "archived_before": cutoff.strftime(DAY_FORMAT) if cutoff else None}
+
+
+if __name__ == "__main__":
+    # Nightly cron entry point: `python log_archive.py`
+    summary = run_archive_job()
+    print(f"Log archive: moved {summary['archived']} movements, archive covers days before {summary['archived_before']}")
@@ -0,0 +1,161 @@
+import sys
+from datetime import datetime
+from typing import Optional
+from urllib.parse import unquote
+from bson import ObjectId
+from pymongo import ReturnDocument
+from database import client, orders_collection, order_counters_collection
+
+# Counter documents:
+#   {"_id": "all", "total": n, "status": {"Shipped": n, ...}}
+#   {"_id": "2025-07-03", "total": n, "status": {...}}   one per order day
+# Every order write updates them inside the same transaction, so dashboard
+# KPIs are a single find_one instead of a scan of the order history.
+# Status names come from clients, so they are escaped before being used as
+# keys (see status_key).
+ALL_ORDERS = "all"
+ORDER_DATE_FORMAT = "%d/%m/%Y"
+SHIPPED = "Shipped"
+
+
+def status_key(status) -> str:
+    # "." would nest the counter and "$" / "" are invalid field names
+    key = str(status).replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+    return key or "%00"
+
+
+def status_label(key: str) -> str:
+    return "" if key == "%00" else unquote(key)
+
+
+def order_day(order: dict) -> Optional[str]:
+    try:
+        return datetime.strptime(order.get("date") or "", ORDER_DATE_FORMAT).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def counter_ids(order: dict):
+    day = order_day(order)
+    return [ALL_ORDERS, day] if day else [ALL_ORDERS]
+
+
+def apply_delta(order: dict, status: str, delta: int, session, include_total: bool = True):
+    inc = {f"status.{status_key(status)}": delta}
+    if include_total:
+        inc["total"] = delta
+    for counter_id in counter_ids(order):
+        order_counters_collection.update_one({"_id": counter_id}, {"$inc": inc}, upsert=True, session=session)
+
+
+# --- Order Writes ---
+
+def create_order(order_data: dict) -> dict:
+    def write(session):
+        result = orders_collection.insert_one(order_data, session=session)
+        apply_delta(order_data, order_data.get("status"), 1, session)
+        return result.inserted_id
+
+    with client.start_session() as session:
+        inserted_id = session.with_transaction(write)
+    return orders_collection.find_one({"_id": inserted_id})
+
+
+def change_order_status(order_id: str, status: str, extra_fields: Optional[dict] = None) -> Optional[dict]:
+    def write(session):
+        previous = orders_collection.find_one_and_update(
+            {"_id": ObjectId(order_id)},
+            {"$set": {"status": status, **(extra_fields or {})}},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if previous is not None and previous.get("status") != status:
+            apply_delta(previous, previous.get("status"), -1, session, include_total=False)
+            apply_delta(previous, status, 1, session, include_total=False)
+        return previous
+
+    with client.start_session() as session:
+        previous = session.with_transaction(write)
+    return None if previous is None else {**previous, "status": status}
+
+
+def remove_order(order_id: str) -> bool:
+    def write(session):
+        deleted = orders_collection.find_one_and_delete({"_id": ObjectId(order_id)}, session=session)
+        if deleted is not None:
+            apply_delta(deleted, deleted.get("status"), -1, session)
+        return deleted is not None
+
+    with client.start_session() as session:
+        return session.with_transaction(write)
+
+
+# --- Reads ---
+
+def order_kpis() -> dict:
+    counters = order_counters_collection.find_one({"_id": ALL_ORDERS}) or {}
+    by_status = {status_label(key): count for key, count in counters.get("status", {}).items()}
+    total = counters.get("total", 0)
+    return {
+        "total_orders": total,
+        "pending_orders": total - by_status.get(SHIPPED, 0),
+        "by_status": by_status
+    }
+
+
+# --- Reconciliation ---
+
+def reconcile_order_counters(apply: bool = True) -> dict:
+    """Rebuild every counter from orders_collection and report where the stored ones drifted.
+
+    Best run in a quiet window: orders written while the scan is running can
+    make the rebuilt counters themselves drift until the next reconciliation.
+    """
+    pipeline = [{"$group": {"_id": {"date": "$date", "status": "$status"}, "count": {"$sum": 1}}}]
+    expected = {}
+    for doc in orders_collection.aggregate(pipeline, allowDiskUse=True):
+        status = status_key(doc["_id"].get("status"))
+        for counter_id in counter_ids({"date": doc["_id"].get("date")}):
+            counter = expected.setdefault(counter_id, {"_id": counter_id, "total": 0, "status": {}})
+            counter["total"] += doc["count"]
+            counter["status"][status] = counter["status"].get(status, 0) + doc["count"]
+
+    stored = {doc["_id"]: doc for doc in order_counters_collection.find()}
+    drift = []
+    for counter_id in sorted(set(expected) | set(stored)):
+        want = expected.get(counter_id, {"total": 0, "status": {}})
+        have = stored.get(counter_id, {})
+        have_status = have.get("status", {})
+        if have.get("total", 0) != want["total"]:
+            drift.append({"counter": counter_id, "field": "total", "stored": have.get("total", 0), "actual": want["total"]})
+        for status in sorted(set(want["status"]) | set(have_status)):
+            if have_status.get(status, 0) != want["status"].get(status, 0):
+                drift.append({
+                    "counter": counter_id,
+                    "field": f"status.{status}",
+                    "stored": have_status.get(status, 0),
+                    "actual": want["status"].get(status, 0)
+                })
+
+    if apply and drift:
+        for counter_id in set(stored) - set(expected):
+            order_counters_collection.delete_one({"_id": counter_id})
+        for counter in expected.values():
+            order_counters_collection.replace_one({"_id": counter["_id"]}, counter, upsert=True)
+
+    return {"counters": len(expected), "drift": drift, "applied": apply and bool(drift)}
+
+
+def ensure_order_counters():
+    # First start on an existing database: seed from the order history, otherwise
+    # pending_orders reads 0 and deleting an older order drives the counters negative
+    if order_counters_collection.find_one({"_id": ALL_ORDERS}, {"_id": 1}) is None:
+        reconcile_order_counters(apply=True)
+
+
+if __name__ == "__main__":
+    # `python order_counters.py` rebuilds the counters; add --dry-run to only report drift
+    report = reconcile_order_counters(apply="--dry-run" not in sys.argv)
+    for entry in report["drift"]:
+        print(f"{entry['counter']} {entry['field']}: stored {entry['stored']}, actual {entry['actual']}")
+    print(f"Order counters: {report['counters']} checked, {len(report['drift'])} drifted, applied={report['applied']}")
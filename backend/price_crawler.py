@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import datetime
+from typing import Dict, Optional
+from urllib.parse import urlparse
+import httpx
+from bs4 import BeautifulSoup
+from database import automation_collection, crawl_cache_collection
+from data_version import bump_data_version
+from delta_sync import stamped_bulk_write
+
+# Price Crawler Config
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "50"))
+CRAWL_PER_HOST = int(os.getenv("CRAWL_PER_HOST", "2"))
+CRAWL_HOST_DELAY = float(os.getenv("CRAWL_HOST_DELAY", "1.0"))  # Seconds between requests to one host
+CRAWL_BROWSER_CONCURRENCY = int(os.getenv("CRAWL_BROWSER_CONCURRENCY", "2"))
+CRAWL_TIMEOUT = float(os.getenv("CRAWL_TIMEOUT", "20"))
+USER_AGENT = "VoltStock-PriceCheck/1.0"
+
+PRICE_PATTERN = re.compile(r"(\d{1,3}(?:[,\s]\d{3})*(?:\.\d+)?|\d+(?:\.\d+)?)")
+
+
+# --- Parsing ---
+
+def parse_price(value) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = PRICE_PATTERN.search(str(value))
+    return float(re.sub(r"[,\s]", "", match.group(1))) if match else None
+
+
+def parse_availability(value) -> Optional[str]:
+    if not value:
+        return None
+    # schema.org values look like "https://schema.org/InStock"
+    return str(value).rstrip("/").rsplit("/", 1)[-1]
+
+
+def parse_offer(html: str) -> Optional[dict]:
+    """Price, currency and availability from JSON-LD Product data or product meta tags."""
+    soup = BeautifulSoup(html, "html.parser")
+
+    for script in soup.find_all("script", type="application/ld+json"):
+        try:
+            data = json.loads(script.string or "")
+        except ValueError:
+            continue
+        nodes = data if isinstance(data, list) else data.get("@graph", [data]) if isinstance(data, dict) else []
+        for node in nodes:
+            if not isinstance(node, dict) or "offers" not in node:
+                continue
+            offers = node["offers"]
+            offer = offers[0] if isinstance(offers, list) and offers else offers
+            if isinstance(offer, dict):
+                price = parse_price(offer.get("price", offer.get("lowPrice")))
+                if price is not None:
+                    return {
+                        "price": price,
+                        "currency": offer.get("priceCurrency"),
+                        "availability": parse_availability(offer.get("availability"))
+                    }
+
+    def meta(*names):
+        for name in names:
+            tag = soup.find("meta", attrs={"property": name}) or soup.find("meta", attrs={"itemprop": name})
+            if tag and tag.get("content"):
+                return tag["content"]
+        return None
+
+    price = parse_price(meta("product:price:amount", "og:price:amount", "price"))
+    if price is None:
+        tag = soup.find(attrs={"itemprop": "price"})
+        price = parse_price(tag.get("content") or tag.get_text()) if tag else None
+    if price is None:
+        return None
+
+    availability = meta("product:availability", "og:availability", "availability")
+    if availability is None:
+        tag = soup.find(attrs={"itemprop": "availability"})
+        availability = (tag.get("href") or tag.get("content")) if tag else None
+    return {
+        "price": price,
+        "currency": meta("product:price:currency", "og:price:currency", "priceCurrency"),
+        "availability": parse_availability(availability)
+    }
+
+
+def looks_client_rendered(html: str) -> bool:
+    # Little visible text plus a script-driven app shell means the offer is filled in by JS
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "noscript"]):
+        tag.decompose()
+    return len(soup.get_text(" ", strip=True)) < 200
+
+
+# --- Fetching ---
+
+class HostGate:
+    """Per-host concurrency cap plus a minimum delay between request starts."""
+
+    def __init__(self, concurrency: int, delay: float):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.delay = delay
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        async with self.lock:
+            wait = self.next_start - time.monotonic()
+            self.next_start = max(time.monotonic(), self.next_start) + self.delay
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def __aexit__(self, *exc):
+        self.semaphore.release()
+
+
+class PriceCrawler:
+    """Bounded-concurrency supplier page fetcher with conditional GET and a content-hash cache.
+
+    Pages whose offer only appears after JavaScript runs are rendered in a
+    shared headless Chromium, and remembered as such in the cache. Pass a
+    `client` to point the crawler at another transport, e.g. a local fixture
+    server.
+    """
+
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
+        self.client = client
+        self._owns_client = client is None
+        self.global_gate = asyncio.Semaphore(CRAWL_CONCURRENCY)
+        self.browser_gate = asyncio.Semaphore(CRAWL_BROWSER_CONCURRENCY)
+        self.hosts: Dict[str, HostGate] = {}
+        self._playwright = None
+        self._browser = None
+        self._browser_lock = asyncio.Lock()
+        self.counters = {"fetched": 0, "not_modified": 0, "unchanged": 0, "parsed": 0, "rendered": 0, "failed": 0}
+
+    async def __aenter__(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=CRAWL_TIMEOUT, follow_redirects=True, headers={"User-Agent": USER_AGENT},
+                limits=httpx.Limits(max_connections=CRAWL_CONCURRENCY)
+            )
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._owns_client:
+            await self.client.aclose()
+        if self._browser is not None:
+            await self._browser.close()
+            await self._playwright.stop()
+
+    def _host(self, url: str) -> HostGate:
+        host = urlparse(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = HostGate(CRAWL_PER_HOST, CRAWL_HOST_DELAY)
+        return self.hosts[host]
+
+    async def render(self, url: str) -> str:
+        async with self.browser_gate:
+            async with self._browser_lock:
+                if self._browser is None:
+                    from playwright.async_api import async_playwright
+                    self._playwright = await async_playwright().start()
+                    self._browser = await self._playwright.chromium.launch()
+            page = await self._browser.new_page(user_agent=USER_AGENT)
+            try:
+                await page.goto(url, wait_until="networkidle", timeout=CRAWL_TIMEOUT * 1000)
+                self.counters["rendered"] += 1
+                return await page.content()
+            finally:
+                await page.close()
+
+    async def check(self, url: str) -> Optional[dict]:
+        cached = await asyncio.to_thread(crawl_cache_collection.find_one, {"_id": url}) or {}
+        try:
+            # Host politeness first, so waiting on a slow host doesn't hold a global slot
+            async with self._host(url), self.global_gate:
+                if cached.get("needs_browser"):
+                    html = await self.render(url)
+                    return await self._store(url, cached, html, {}, needs_browser=True)
+
+                headers = {}
+                if cached.get("etag"):
+                    headers["If-None-Match"] = cached["etag"]
+                if cached.get("last_modified"):
+                    headers["If-Modified-Since"] = cached["last_modified"]
+                response = await self.client.get(url, headers=headers)
+
+                if response.status_code == 304 and cached:
+                    self.counters["not_modified"] += 1
+                    return cached.get("offer")
+                response.raise_for_status()
+                self.counters["fetched"] += 1
+                return await self._store(url, cached, response.text, response.headers)
+        except Exception as e:
+            self.counters["failed"] += 1
+            print(f"Price check failed for {url}: {e}")
+            return None
+
+    async def _store(self, url: str, cached: dict, html: str, headers, needs_browser: bool = False) -> Optional[dict]:
+        content_hash = hashlib.sha256(html.encode("utf-8")).hexdigest()
+        if cached.get("content_hash") == content_hash:
+            self.counters["unchanged"] += 1
+            offer = cached.get("offer")
+        else:
+            self.counters["parsed"] += 1
+            offer = parse_offer(html)
+            if offer is None and not needs_browser and looks_client_rendered(html):
+                needs_browser = True
+                offer = parse_offer(await self.render(url))
+
+        await asyncio.to_thread(crawl_cache_collection.replace_one, {"_id": url}, {
+            "_id": url,
+            "etag": headers.get("etag"),
+            "last_modified": headers.get("last-modified"),
+            "content_hash": content_hash,
+            "needs_browser": needs_browser,
+            "offer": offer,
+            "fetched_at": datetime.utcnow()
+        }, upsert=True)
+        return offer
+
+
+async def run_price_check(client: Optional[httpx.AsyncClient] = None) -> dict:
+    rules = list(automation_collection.find(
+        {"status": "active", "source_link": {"$regex": "^https?://"}}, {"source_link": 1}
+    ))
+    # Many rules share a supplier page; each URL is fetched once per run
+    urls = sorted({rule["source_link"] for rule in rules})
+
+    async with PriceCrawler(client) as crawler:
+        offers = dict(zip(urls, await asyncio.gather(*(crawler.check(url) for url in urls))))
+
+    checked_at = datetime.utcnow()
+    updates = [(rule["_id"], offers[rule["source_link"]]) for rule in rules if offers.get(rule["source_link"])]
+    if updates:
+        stamped_bulk_write("automations", [(rule_id, {
+            "supplier_price": offer["price"],
+            "supplier_currency": offer.get("currency"),
+            "supplier_availability": offer.get("availability"),
+            "price_checked_at": checked_at
+        }) for rule_id, offer in updates])
+        bump_data_version()
+
+    return {"urls": len(urls), "rules_updated": len(updates), **crawler.counters}
+
+
+if __name__ == "__main__":
+    # Scheduled entry point, e.g. hourly: `python price_crawler.py`
+    summary = asyncio.run(run_price_check())
+    print("Price check: " + ", ".join(f"{key}={value}" for key, value in summary.items()))
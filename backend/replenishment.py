@@ -0,0 +1,186 @@
+import math
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import numpy as np
+from database import inventory_collection, logs_collection, job_state_collection
+from data_version import bump_data_version
+from delta_sync import stamped_bulk_write
+
+# Replenishment Config
+DEMAND_WINDOW_DAYS = int(os.getenv("DEMAND_WINDOW_DAYS", "90"))
+DEFAULT_LEAD_TIME_DAYS = float(os.getenv("DEFAULT_LEAD_TIME_DAYS", "7"))
+DEFAULT_LEAD_TIME_STD_DAYS = float(os.getenv("DEFAULT_LEAD_TIME_STD_DAYS", "0"))
+SERVICE_LEVEL_Z = float(os.getenv("SERVICE_LEVEL_Z", "1.65"))  # ~95% cycle service level
+ITEM_BATCH_SIZE = 10000
+
+JOB_ID = "replenishment"
+
+
+def window_dates(as_of: datetime, days: int = DEMAND_WINDOW_DAYS) -> List[str]:
+    # Log dates are stored as dd/mm/yyyy strings, so the window is an explicit $in list
+    return [(as_of - timedelta(days=i)).strftime("%d/%m/%Y") for i in range(days)]
+
+
+def changed_items(since_id, until_id) -> List[str]:
+    # Items with at least one movement in (since_id, until_id]
+    id_range = {"$lte": until_id}
+    if since_id is not None:
+        id_range["$gt"] = since_id
+
+    pipeline = [
+        {"$match": {"_id": id_range}},
+        {"$group": {"_id": "$item"}},
+    ]
+    return [doc["_id"] for doc in logs_collection.aggregate(pipeline, allowDiskUse=True)]
+
+
+def demand_moments(items: Optional[List[str]], dates: List[str]) -> Dict[str, tuple]:
+    # Sum and sum of squares of daily outbound quantity per item, computed server-side
+    match = {"in_out": "out", "date": {"$in": dates}}
+    if items is not None:
+        match["item"] = {"$in": items}
+
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": {"item": "$item", "date": "$date"}, "qty": {"$sum": "$quantity"}}},
+        {"$group": {
+            "_id": "$_id.item",
+            "total": {"$sum": "$qty"},
+            "total_sq": {"$sum": {"$multiply": ["$qty", "$qty"]}},
+        }},
+    ]
+    return {
+        doc["_id"]: (doc["total"], doc["total_sq"])
+        for doc in logs_collection.aggregate(pipeline, allowDiskUse=True)
+    }
+
+
+def compute_policy(total, total_sq, lead_time, lead_time_std, window_days: int = DEMAND_WINDOW_DAYS,
+                   z: float = SERVICE_LEVEL_Z) -> Dict[str, np.ndarray]:
+    """Vectorized safety stock / reorder point for a whole batch of SKUs.
+
+    Days without outbound movements count as zero demand, so the moments are
+    taken over the full window rather than over the days that had sales.
+    """
+    total = np.asarray(total, dtype=np.float64)
+    total_sq = np.asarray(total_sq, dtype=np.float64)
+    lead_time = np.asarray(lead_time, dtype=np.float64)
+    lead_time_std = np.asarray(lead_time_std, dtype=np.float64)
+
+    mean = total / window_days
+    # Sample variance of the daily series, clipped against float round-off
+    variance = np.maximum(total_sq / window_days - mean ** 2, 0.0) * window_days / max(window_days - 1, 1)
+
+    safety_stock = z * np.sqrt(lead_time * variance + (mean * lead_time_std) ** 2)
+    reorder_point = mean * lead_time + safety_stock
+
+    return {
+        "demandMean": mean,
+        "demandStd": np.sqrt(variance),
+        "safetyStock": np.ceil(safety_stock).astype(np.int64),
+        "reorderPoint": np.ceil(reorder_point).astype(np.int64),
+    }
+
+
+def lead_time_value(value, default: float) -> float:
+    # Missing, null or non-numeric lead times would turn into NaN safety stock
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return value if math.isfinite(value) and value >= 0 else default
+
+
+INVENTORY_PROJECTION = {"name": 1, "leadTimeDays": 1, "leadTimeStdDays": 1}
+
+
+def inventory_batches(items: Optional[List[str]]):
+    # Full runs stream the whole catalog; incremental runs look up only the touched names
+    if items is None:
+        cursor = inventory_collection.find({}, INVENTORY_PROJECTION, batch_size=ITEM_BATCH_SIZE)
+        batch = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) == ITEM_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        return
+
+    for start in range(0, len(items), ITEM_BATCH_SIZE):
+        batch = list(inventory_collection.find(
+            {"name": {"$in": items[start:start + ITEM_BATCH_SIZE]}},
+            INVENTORY_PROJECTION
+        ))
+        if batch:
+            yield batch
+
+
+def build_updates(items: Optional[List[str]], moments: Dict[str, tuple], computed_at: datetime) -> List[tuple]:
+    updates = []
+
+    for docs in inventory_batches(items):
+        total = [moments.get(doc.get("name"), (0, 0))[0] for doc in docs]
+        total_sq = [moments.get(doc.get("name"), (0, 0))[1] for doc in docs]
+        lead_time = [lead_time_value(doc.get("leadTimeDays"), DEFAULT_LEAD_TIME_DAYS) for doc in docs]
+        lead_time_std = [lead_time_value(doc.get("leadTimeStdDays"), DEFAULT_LEAD_TIME_STD_DAYS) for doc in docs]
+
+        policy = compute_policy(total, total_sq, lead_time, lead_time_std)
+
+        for i, doc in enumerate(docs):
+            updates.append((doc["_id"], {
+                "demandMean": round(float(policy["demandMean"][i]), 4),
+                "demandStd": round(float(policy["demandStd"][i]), 4),
+                "safetyStock": int(policy["safetyStock"][i]),
+                "reorderPoint": int(policy["reorderPoint"][i]),
+                "replenishmentUpdatedAt": computed_at,
+            }))
+
+    return updates
+
+
+def run_replenishment_job(full: bool = False, as_of: Optional[datetime] = None) -> dict:
+    as_of = as_of or datetime.now()
+    state = job_state_collection.find_one({"_id": JOB_ID}) or {}
+    since_id = None if full else state.get("last_log_id")
+
+    latest = logs_collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    if latest is None:
+        return {"updated": 0, "skus": 0}
+    until_id = latest["_id"]
+
+    if since_id is not None and since_id >= until_id:
+        return {"updated": 0, "skus": 0}
+
+    dates = window_dates(as_of)
+    if full:
+        items = None
+        moments = demand_moments(None, dates)
+    else:
+        items = changed_items(since_id, until_id)
+        moments = {}
+        for start in range(0, len(items), ITEM_BATCH_SIZE):
+            moments.update(demand_moments(items[start:start + ITEM_BATCH_SIZE], dates))
+
+    updates = build_updates(items, moments, as_of)
+    modified = stamped_bulk_write("inventory", updates)
+    if modified:
+        bump_data_version()
+
+    # Only advance the watermark once the write-back succeeded
+    job_state_collection.update_one(
+        {"_id": JOB_ID},
+        {"$set": {"last_log_id": until_id, "last_run": as_of, "last_updated": modified}},
+        upsert=True
+    )
+
+    return {"updated": modified, "skus": len(updates)}
+
+
+if __name__ == "__main__":
+    # Nightly cron entry point, e.g. `python replenishment.py` (add --full to rebuild every SKU)
+    summary = run_replenishment_job(full="--full" in sys.argv)
+    print(f"Replenishment job: recomputed {summary['skus']} SKUs, {summary['updated']} documents changed")
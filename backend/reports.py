@@ -0,0 +1,305 @@
+import csv
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, Optional
+from bson import ObjectId
+from database import inventory_collection, logs_collection, logs_archive_collection, reports_collection
+from log_archive import archive_cutoff, archive_range_filter, live_range_filter, needs_archive
+
+# Report Queue Config
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+MAX_PENDING_REPORTS = int(os.getenv("MAX_PENDING_REPORTS", "20"))
+# A running job's worker renews its lease every third of this; only expired leases are re-queued
+REPORT_LEASE_SECONDS = float(os.getenv("REPORT_LEASE_SECONDS", "60"))
+REPORTS_DIR = Path(os.getenv("REPORTS_DIR", Path(__file__).resolve().parent / "reports"))
+CURSOR_BATCH_SIZE = 2000
+PPTX_ROWS_PER_SLIDE = 15
+PPTX_MAX_ROWS = 150  # Slides are a summary; CSV/XLSX carry the full data
+
+REPORT_FORMATS = {"csv": "text/csv",
+                  "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                  "pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation"}
+
+
+class ReportQueueFull(Exception):
+    pass
+
+
+# --- Report Sources (streamed from cursors, never materialized) ---
+
+def stock_valuation_rows(params: dict) -> Iterator[list]:
+    cursor = inventory_collection.find(
+        {}, {"name": 1, "category": 1, "location": 1, "stock": 1, "unitPrice": 1}, batch_size=CURSOR_BATCH_SIZE
+    ).sort("category", 1)
+    for doc in cursor:
+        stock = doc.get("stock", 0)
+        unit_price = doc.get("unitPrice", 0.0)
+        yield [str(doc["_id"]), doc.get("name"), doc.get("category"), doc.get("location"),
+               stock, unit_price, round(stock * unit_price, 2)]
+
+
+def movement_audit_rows(params: dict) -> Iterator[list]:
+    start = datetime.strptime(params["start"], "%Y-%m-%d") if params.get("start") else None
+    end = datetime.strptime(params["end"], "%Y-%m-%d") if params.get("end") else None
+
+    def row(log, in_out):
+        return [log["date"], str(log["_id"]), log.get("item"), in_out, log.get("quantity"), log.get("value"),
+                round(log.get("quantity", 0) * log.get("value", 0), 2), log.get("source_customer"), log.get("responsible")]
+
+    cutoff = archive_cutoff()
+    live = logs_collection.find(live_range_filter(start, end, cutoff), batch_size=CURSOR_BATCH_SIZE)
+    for log in live.sort("_id", 1):
+        yield row(log, log.get("in_out"))
+
+    if needs_archive(start, cutoff):
+        for in_out in ("in", "out"):
+            buckets = logs_archive_collection.find(archive_range_filter(in_out, start, end, cutoff), batch_size=10)
+            for bucket in buckets.sort("day", 1):
+                for log in bucket["movements"]:
+                    yield row(log, in_out)
+
+
+def low_stock_rows(params: dict) -> Iterator[list]:
+    pipeline = [
+        {"$match": {"$expr": {"$lt": ["$stock", "$minStock"]}}},
+        {"$project": {"name": 1, "category": 1, "location": 1, "stock": 1, "minStock": 1, "reorderPoint": 1,
+                      "shortfall": {"$subtract": ["$minStock", "$stock"]}}},
+        {"$sort": {"shortfall": -1}}
+    ]
+    for doc in inventory_collection.aggregate(pipeline, allowDiskUse=True, batchSize=CURSOR_BATCH_SIZE):
+        yield [str(doc["_id"]), doc.get("name"), doc.get("category"), doc.get("location"),
+               doc.get("stock"), doc.get("minStock"), doc.get("reorderPoint"), doc.get("shortfall")]
+
+
+REPORTS = {
+    "stock_valuation": ("Stock Valuation",
+                        ["SKU", "Name", "Category", "Location", "Stock", "Unit Price", "Total Value"],
+                        stock_valuation_rows),
+    "movement_audit": ("Movement Audit",
+                       ["Date", "ID", "Item", "In/Out", "Quantity", "Value", "Total Value", "Source/Customer", "Responsible"],
+                       movement_audit_rows),
+    "low_stock_summary": ("Low Stock Summary",
+                          ["SKU", "Name", "Category", "Location", "Stock", "Min Stock", "Reorder Point", "Shortfall"],
+                          low_stock_rows),
+}
+REPORT_TYPES = set(REPORTS)
+
+
+# --- Writers ---
+
+def write_csv(path: Path, title: str, columns: list, rows: Iterator[list]) -> int:
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def write_xlsx(path: Path, title: str, columns: list, rows: Iterator[list]) -> int:
+    from openpyxl import Workbook
+
+    # write_only streams rows to disk instead of holding the whole sheet in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title[:31])
+    sheet.append(columns)
+    count = 0
+    for row in rows:
+        sheet.append(row)
+        count += 1
+    workbook.save(path)
+    return count
+
+
+def write_pptx(path: Path, title: str, columns: list, rows: Iterator[list]) -> int:
+    from pptx import Presentation
+    from pptx.util import Inches, Pt
+
+    presentation = Presentation()
+    presentation.slide_width = Inches(13.333)
+    presentation.slide_height = Inches(7.5)
+    title_slide = presentation.slides.add_slide(presentation.slide_layouts[0])
+    title_slide.shapes.title.text = f"VoltStock {title}"
+
+    def add_table(chunk):
+        slide = presentation.slides.add_slide(presentation.slide_layouts[5])
+        slide.shapes.title.text = title
+        table = slide.shapes.add_table(len(chunk) + 1, len(columns), Inches(0.4), Inches(1.4),
+                                       Inches(12.5), Inches(0.3) * (len(chunk) + 1)).table
+        for c, column in enumerate(columns):
+            table.cell(0, c).text = column
+        for r, values in enumerate(chunk, start=1):
+            for c, value in enumerate(values):
+                table.cell(r, c).text = "" if value is None else str(value)
+        for cell in (table.cell(r, c) for r in range(len(chunk) + 1) for c in range(len(columns))):
+            for paragraph in cell.text_frame.paragraphs:
+                paragraph.font.size = Pt(10)
+
+    count = 0
+    chunk = []
+    for row in rows:
+        count += 1
+        if count > PPTX_MAX_ROWS:
+            continue  # Keep counting so the summary reports the full size
+        chunk.append(row)
+        if len(chunk) == PPTX_ROWS_PER_SLIDE:
+            add_table(chunk)
+            chunk = []
+    if chunk:
+        add_table(chunk)
+
+    subtitle = f"{count:,} rows, generated {datetime.now():%d/%m/%Y %H:%M}"
+    if count > PPTX_MAX_ROWS:
+        subtitle += f" (first {PPTX_MAX_ROWS} shown; export CSV/XLSX for the full report)"
+    title_slide.placeholders[1].text = subtitle
+    presentation.save(path)
+    return count
+
+
+WRITERS = {"csv": write_csv, "xlsx": write_xlsx, "pptx": write_pptx}
+
+
+# --- Worker (runs in a child process with its own MongoClient) ---
+
+def lease_expiry() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=REPORT_LEASE_SECONDS)
+
+
+def hold_lease(job_id: ObjectId, owner: str, stop: threading.Event):
+    while not stop.wait(REPORT_LEASE_SECONDS / 3):
+        reports_collection.update_one({"_id": job_id, "owner": owner}, {"$set": {"lease_expires": lease_expiry()}})
+
+
+def render_report(job_id: str):
+    owner = uuid.uuid4().hex
+    job = reports_collection.find_one_and_update(
+        {"_id": ObjectId(job_id), "status": "queued"},
+        {"$set": {"status": "running", "started_at": datetime.utcnow(), "owner": owner, "lease_expires": lease_expiry()}}
+    )
+    if job is None:
+        return
+
+    path = REPORTS_DIR / f"{job_id}.{job['format']}"
+    stop = threading.Event()
+    threading.Thread(target=hold_lease, args=(job["_id"], owner, stop), daemon=True).start()
+    try:
+        title, columns, source = REPORTS[job["type"]]
+        REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+        rows = WRITERS[job["format"]](path, title, columns, source(job.get("params", {})))
+        outcome = {"status": "done", "finished_at": datetime.utcnow(), "rows": rows, "artifact": str(path)}
+    except Exception as e:
+        path.unlink(missing_ok=True)
+        outcome = {"status": "failed", "finished_at": datetime.utcnow(), "error": str(e)}
+    finally:
+        stop.set()
+    # Only while we still own the job; a lost lease means another worker has taken it over
+    reports_collection.update_one({"_id": job["_id"], "owner": owner}, {"$set": outcome})
+
+
+# --- Queue (API process) ---
+
+class ReportQueue:
+    """Persistent report jobs rendered by a process pool, off the API's request path."""
+
+    def __init__(self, workers: int = REPORT_WORKERS, max_pending: int = MAX_PENDING_REPORTS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # spawn, not fork: a forked child would inherit the parent's MongoClient sockets
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def _discard_pool(self, executor: ProcessPoolExecutor):
+        # A worker that died (os._exit, OOM kill) breaks the whole pool; the next dispatch builds a new one
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _dispatch(self, job_id: str, reserved: bool = False):
+        if not reserved:
+            with self._lock:
+                self.pending += 1
+        try:
+            try:
+                executor = self._pool()
+                future = executor.submit(render_report, job_id)
+            except BrokenProcessPool:
+                self._discard_pool(executor)
+                executor = self._pool()
+                future = executor.submit(render_report, job_id)
+        except Exception as e:
+            with self._lock:
+                self.pending -= 1
+            reports_collection.update_one(
+                {"_id": ObjectId(job_id), "status": "queued"},
+                {"$set": {"status": "failed", "finished_at": datetime.utcnow(), "error": f"Could not dispatch: {e}"}}
+            )
+            raise
+        future.add_done_callback(lambda f: self._finished(job_id, executor, f))
+
+    def _finished(self, job_id: str, executor: ProcessPoolExecutor, future):
+        with self._lock:
+            self.pending -= 1
+        if future.cancelled():
+            return  # Shutdown; the job stays queued and is picked up by recover()
+        if isinstance(future.exception(), BrokenProcessPool):
+            self._discard_pool(executor)
+        if future.exception() is not None:
+            # The worker died before it could record the outcome (e.g. a broken pool)
+            reports_collection.update_one(
+                {"_id": ObjectId(job_id), "status": {"$in": ["queued", "running"]}},
+                {"$set": {"status": "failed", "finished_at": datetime.utcnow(), "error": str(future.exception())}}
+            )
+
+    def submit(self, report_type: str, fmt: str, params: Optional[dict] = None) -> dict:
+        # Check and reserve in one step so concurrent submits can't overshoot max_pending
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise ReportQueueFull()
+            self.pending += 1
+
+        job = {"type": report_type, "format": fmt, "params": params or {},
+               "status": "queued", "created_at": datetime.utcnow()}
+        try:
+            job["_id"] = reports_collection.insert_one(job).inserted_id
+        except Exception:
+            with self._lock:
+                self.pending -= 1
+            raise
+        self._dispatch(str(job["_id"]), reserved=True)
+        return job
+
+    def recover(self):
+        # Jobs whose worker died (lease not renewed) are re-queued; jobs another live
+        # API process is still rendering keep their lease and are left alone
+        reports_collection.update_many(
+            {"status": "running", "$or": [{"lease_expires": {"$lt": datetime.utcnow()}},
+                                          {"lease_expires": {"$exists": False}}]},
+            {"$set": {"status": "queued"}, "$unset": {"owner": "", "lease_expires": ""}}
+        )
+        for job in reports_collection.find({"status": "queued"}, {"_id": 1}).sort("created_at", 1):
+            self._dispatch(str(job["_id"]))
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+report_queue = ReportQueue()
@@ -0,0 +1,174 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+# Single-Flight Config
+# Both default to 0: concurrent callers share one computation but nothing is cached afterwards.
+AGGREGATE_FRESH_TTL = float(os.getenv("AGGREGATE_FRESH_TTL", "0"))
+AGGREGATE_STALE_TTL = float(os.getenv("AGGREGATE_STALE_TTL", "0"))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls into one execution.
+
+    Callers asking for the same key while a computation is running wait for
+    that computation instead of starting their own. With `fresh_ttl` the last
+    result is reused for that long, and within the following `stale_ttl`
+    seconds the stale result is returned immediately while a single background
+    refresh runs (stale-while-revalidate).
+    """
+
+    def __init__(self, fresh_ttl: float = 0.0, stale_ttl: float = 0.0):
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._async_calls: Dict[str, asyncio.Future] = {}
+        self._tasks = set()
+        self._results: Dict[str, tuple] = {}
+        self.counters = {"calls": 0, "executions": 0, "coalesced": 0, "fresh_hits": 0, "stale_hits": 0, "errors": 0}
+
+    # --- Shared result store ---
+
+    def _cached(self, key: str):
+        # Returns (value, is_stale) or None. Caller must hold the lock.
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        age = time.monotonic() - entry[1]
+        if age <= self.fresh_ttl:
+            return entry[0], False
+        if age <= self.fresh_ttl + self.stale_ttl:
+            return entry[0], True
+        return None
+
+    def _store(self, key: str, value: Any):
+        if self.fresh_ttl or self.stale_ttl:
+            with self._lock:
+                self._results[key] = (value, time.monotonic())
+
+    def forget(self, key: str):
+        with self._lock:
+            self._results.pop(key, None)
+
+    # --- Sync path ---
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self.counters["calls"] += 1
+            cached = self._cached(key)
+            if cached is not None:
+                value, is_stale = cached
+                if not is_stale:
+                    self.counters["fresh_hits"] += 1
+                    return value
+                self.counters["stale_hits"] += 1
+                if key not in self._calls:
+                    self._calls[key] = _Call()
+                    threading.Thread(target=self._run, args=(key, fn), daemon=True).start()
+                return value
+
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.counters["coalesced"] += 1
+
+        if leader:
+            self._run(key, fn)
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _run(self, key: str, fn: Callable[[], Any]):
+        call = self._calls[key]
+        try:
+            call.result = fn()
+            self._store(key, call.result)
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self.counters["errors"] += 1
+        finally:
+            with self._lock:
+                self.counters["executions"] += 1
+                self._calls.pop(key, None)
+            call.done.set()
+
+    # --- Async path ---
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        with self._lock:
+            self.counters["calls"] += 1
+            cached = self._cached(key)
+            if cached is not None:
+                value, is_stale = cached
+                if not is_stale:
+                    self.counters["fresh_hits"] += 1
+                    return value
+                self.counters["stale_hits"] += 1
+                if key not in self._async_calls:
+                    self._async_calls[key] = asyncio.get_running_loop().create_future()
+                    self._spawn(key, fn)
+                return value
+
+            future = self._async_calls.get(key)
+            leader = future is None
+            if leader:
+                future = asyncio.get_running_loop().create_future()
+                self._async_calls[key] = future
+            else:
+                self.counters["coalesced"] += 1
+
+        if leader:
+            self._spawn(key, fn)
+        # shield() so one cancelled waiter (the leader included) doesn't cancel the shared result
+        return await asyncio.shield(future)
+
+    def _spawn(self, key: str, fn: Callable[[], Awaitable[Any]]):
+        # The computation runs in its own task, so a client disconnect that cancels
+        # the leader's request doesn't leave followers waiting on a future nobody resolves
+        task = asyncio.get_running_loop().create_task(self._run_async(key, fn))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_async(self, key: str, fn: Callable[[], Awaitable[Any]]):
+        future = self._async_calls[key]
+        try:
+            result = await fn()
+            self._store(key, result)
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+            with self._lock:
+                self.counters["errors"] += 1
+        finally:
+            with self._lock:
+                self.counters["executions"] += 1
+                self._async_calls.pop(key, None)
+            if not future.done():
+                future.cancel()  # The task itself was cancelled (e.g. shutdown); release the waiters
+            # Mark the exception retrieved so a background refresh nobody awaits doesn't warn
+            if future.done() and not future.cancelled():
+                future.exception()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {**self.counters, "in_flight": len(self._calls) + len(self._async_calls)}
+
+
+aggregate_flight = SingleFlight(fresh_ttl=AGGREGATE_FRESH_TTL, stale_ttl=AGGREGATE_STALE_TTL)
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import price_crawler
+from price_crawler import PriceCrawler, parse_offer
+
+FILLER = "<p>" + "Industrial lithium cells, rated and tested. " * 10 + "</p>"
+
+JSON_LD_PAGE = """<html><head><script type="application/ld+json">{}</script></head><body>{}</body></html>""".format(
+    json.dumps({"@context": "https://schema.org", "@type": "Product", "name": "Cell",
+                "offers": {"@type": "Offer", "price": "1,299.50", "priceCurrency": "EUR",
+                           "availability": "https://schema.org/InStock"}}),
+    FILLER
+)
+
+META_PAGE = """<html><head>
+<meta property="product:price:amount" content="42.10">
+<meta property="product:price:currency" content="USD">
+<meta property="product:availability" content="out of stock">
+</head><body>{}</body></html>""".format(FILLER)
+
+
+class FixtureServer:
+    """Local supplier site: fixed pages, optional ETags, and per-Host concurrency tracking."""
+
+    def __init__(self, pages: dict, delay: float = 0.0):
+        self.pages = pages  # path -> (html, etag or None)
+        self.delay = delay
+        self.requests = []  # (path, Host, If-None-Match, start time)
+        self.active = {}
+        self.max_active = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.port = self.server.server_address[1]
+
+    def _handler(self):
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                host = self.headers["Host"].split(":")[0]
+                with fixture.lock:
+                    fixture.requests.append((self.path, host, self.headers.get("If-None-Match"), time.monotonic()))
+                    fixture.active[host] = fixture.active.get(host, 0) + 1
+                    fixture.max_active[host] = max(fixture.max_active.get(host, 0), fixture.active[host])
+                try:
+                    time.sleep(fixture.delay)
+                    if self.path not in fixture.pages:
+                        self.send_response(404)
+                        self.end_headers()
+                        return
+                    html, etag = fixture.pages[self.path]
+                    if etag and self.headers.get("If-None-Match") == etag:
+                        self.send_response(304)
+                        self.end_headers()
+                        return
+                    body = html.encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/html; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    if etag:
+                        self.send_header("ETag", etag)
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with fixture.lock:
+                        fixture.active[host] -= 1
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def url(self, path: str, host: str = "127.0.0.1") -> str:
+        return f"http://{host}:{self.port}{path}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeCache:
+    """In-memory stand-in for crawl_cache_collection."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def find_one(self, query):
+        doc = self.docs.get(query["_id"])
+        return dict(doc) if doc else None
+
+    def replace_one(self, query, doc, upsert=False):
+        self.docs[query["_id"]] = dict(doc)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = FakeCache()
+    monkeypatch.setattr(price_crawler, "crawl_cache_collection", cache)
+    monkeypatch.setattr(price_crawler, "CRAWL_HOST_DELAY", 0.0)
+    return cache
+
+
+def check_all(urls, rounds: int = 1):
+    async def run():
+        async with httpx.AsyncClient() as client:
+            async with PriceCrawler(client) as crawler:
+                results = []
+                for _ in range(rounds):
+                    results.append(await asyncio.gather(*(crawler.check(url) for url in urls)))
+                return results, crawler.counters
+    return asyncio.run(run())
+
+
+# --- Parsing ---
+
+def test_parse_offer_json_ld():
+    assert parse_offer(JSON_LD_PAGE) == {"price": 1299.5, "currency": "EUR", "availability": "InStock"}
+
+
+def test_parse_offer_json_ld_graph_and_offer_list():
+    data = {"@graph": [{"@type": "Organization"},
+                       {"@type": "Product", "offers": [{"lowPrice": 9.99, "priceCurrency": "GBP"}]}]}
+    html = f'<script type="application/ld+json">{json.dumps(data)}</script>'
+    assert parse_offer(html) == {"price": 9.99, "currency": "GBP", "availability": None}
+
+
+def test_parse_offer_meta_tags():
+    assert parse_offer(META_PAGE) == {"price": 42.1, "currency": "USD", "availability": "out of stock"}
+
+
+def test_parse_offer_itemprop_and_missing():
+    html = '<span itemprop="price" content="5.00">$5</span><link itemprop="availability" href="https://schema.org/PreOrder">'
+    assert parse_offer(html) == {"price": 5.0, "currency": None, "availability": "PreOrder"}
+    assert parse_offer("<html><body>No offer here</body></html>") is None
+
+
+# --- Fetching ---
+
+def test_etag_revalidation_returns_cached_offer(cache):
+    with FixtureServer({"/cell": (JSON_LD_PAGE, '"v1"')}) as server:
+        url = server.url("/cell")
+        (first, second), counters = check_all([url], rounds=2)
+
+    assert first == second == [{"price": 1299.5, "currency": "EUR", "availability": "InStock"}]
+    assert [etag for _, _, etag, _ in server.requests] == [None, '"v1"']
+    assert counters["fetched"] == 1
+    assert counters["not_modified"] == 1
+    assert cache.docs[url]["etag"] == '"v1"'
+
+
+def test_unchanged_content_skips_parsing(cache):
+    with FixtureServer({"/meta": (META_PAGE, None)}) as server:
+        (first, second), counters = check_all([server.url("/meta")], rounds=2)
+
+    assert first == second == [{"price": 42.1, "currency": "USD", "availability": "out of stock"}]
+    assert len(server.requests) == 2
+    assert counters["parsed"] == 1
+    assert counters["unchanged"] == 1
+
+
+def test_failed_fetch_is_counted(cache):
+    with FixtureServer({}) as server:
+        (results,), counters = check_all([server.url("/missing")])
+
+    assert results == [None]
+    assert counters["failed"] == 1
+
+
+def test_per_host_concurrency_cap(cache, monkeypatch):
+    monkeypatch.setattr(price_crawler, "CRAWL_PER_HOST", 2)
+    pages = {f"/p{i}": (META_PAGE, None) for i in range(6)}
+    with FixtureServer(pages, delay=0.2) as server:
+        # 127.0.0.1 and localhost reach the same server but are separate hosts to the crawler
+        urls = [server.url(path, host) for path in pages for host in ("127.0.0.1", "localhost")]
+        (results,), counters = check_all(urls)
+
+    assert all(result is not None for result in results)
+    assert server.max_active == {"127.0.0.1": 2, "localhost": 2}
+
+
+def test_per_host_delay(cache, monkeypatch):
+    monkeypatch.setattr(price_crawler, "CRAWL_HOST_DELAY", 0.2)
+    pages = {f"/p{i}": (META_PAGE, None) for i in range(3)}
+    with FixtureServer(pages) as server:
+        check_all([server.url(path) for path in pages])
+
+    starts = sorted(start for _, _, _, start in server.requests)
+    gaps = [later - earlier for earlier, later in zip(starts, starts[1:])]
+    assert len(gaps) == 2
+    assert all(gap >= 0.15 for gap in gaps)